@@ -0,0 +1,109 @@
+#!/usr/bin/env python
+#
+# Plays many local games from one process. A policy is called like a client
+# plugin (see client.AIPlugin): with the game state dict and a util.Deadline
+# for the rest of the game, returning a list of commands. It can also return
+# a helpers.placements.Placement, which the LocalServer plays in one step
+# (see Board.send_placement()). Python AIs such as evaluator.LookaheadPolicy,
+# the C++ AI's search, run in this process; WorkerPolicy plays the C++ AI
+# itself in a worker process. Games are played on a LocalServer each, one
+# after another, and the results come back as GameResults instead of RESULTS
+# lines on stdout. The games are timed by the given LocalServer clock, or by
+# the wall clock:
+#
+#   policy = LookaheadPolicy(load_weights('weights.txt'), placements=True)
+#   simulator = BatchSimulator(policy, clock=CpuClock())
+#   results = simulator.run([1, 2, 3])
+#   print mean_score(results)
+#
+
+import json
+import os
+import time
+
+import util
+from client import (
+    AI_PROCESS_PATH,
+    AIWorker,
+    GameOverError,
+    LocalServer,
+)
+
+# The outcome of one game: its final score, the number of moves made, the
+# seconds the game took and the seconds of those spent in the policy.
+class GameResult(object):
+    __slots__ = ('seed', 'score', 'moves', 'seconds', 'ai_seconds')
+
+    def __init__(self, seed, score, moves, seconds, ai_seconds):
+        self.seed = seed
+        self.score = score
+        self.moves = moves
+        self.seconds = seconds
+        self.ai_seconds = ai_seconds
+
+    def __repr__(self):
+        return 'GameResult(seed=%r, score=%r, moves=%r, seconds=%.2f, ai_seconds=%.2f)' % (
+            self.seed, self.score, self.moves, self.seconds, self.ai_seconds)
+
+class BatchSimulator(object):
+    def __init__(self, policy, timeout=util.AI_CLIENT_TIMEOUT, clock=None):
+        self.policy = policy
+        self.timeout = timeout
+        self.clock = clock
+
+    def play(self, seed):
+        server = LocalServer(seed, self.timeout, self.clock)
+        game = server.get_local_game()
+        started_at = time.time()
+        ai_seconds = 0.0
+        moves = 0
+        while True:
+            move_started_at = time.time()
+            cmds = self.policy(game['game']['game_state'],
+                               util.Deadline(game['competition_seconds_remaining']))
+            ai_seconds += time.time() - move_started_at
+            try:
+                game = server.submit_game_move(0, cmds or [], moves)
+            except GameOverError, e:
+                return GameResult(seed, e.game_state_dict['score'], moves,
+                                  time.time() - started_at, ai_seconds)
+            moves += 1
+
+    # Plays a game for each seed, in order, and returns their GameResults.
+    # If given, `progress` is called with each result as its game ends.
+    def run(self, seeds, progress=None):
+        results = []
+        for seed in seeds:
+            results.append(self.play(seed))
+            if progress is not None:
+                progress(results[-1])
+        return results
+
+# A policy that plays the C++ AI, as the client's --worker mode does: one
+# `dropblox_ai --worker <weights file>` process answers every move of every
+# game, and stop() ends it. With quiet set, the AI's stderr is discarded,
+# and with threads set, the AI's OpenMP loops use that many threads.
+#
+# This is the one policy that is not played in this process, so it is not
+# the default anywhere. The AI's process is not charged by a CpuClock, so
+# play it with the wall clock, as on the server, or with a FixedClock for
+# results that do not depend on the machine's load.
+class WorkerPolicy(object):
+    def __init__(self, weights_file, quiet=False, threads=None):
+        self.worker = AIWorker(AI_PROCESS_PATH, '--worker', weights_file)
+        if quiet:
+            self.worker.stderr = open(os.devnull, 'w')
+        if threads is not None:
+            self.worker.env = dict(os.environ, OMP_NUM_THREADS=str(threads))
+
+    def __call__(self, state, deadline):
+        seconds = deadline.remaining()
+        return self.worker.run(json.dumps(state), json.dumps(seconds), seconds)
+
+    def stop(self):
+        self.worker.stop()
+        if self.worker.stderr is not None:
+            self.worker.stderr.close()
+
+def mean_score(results):
+    return float(sum(result.score for result in results))/len(results)
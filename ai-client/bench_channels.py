@@ -0,0 +1,88 @@
+#!/usr/bin/env python
+#
+# Compares the round-trip latency of the ways the client can hand a game
+# state to an AI process and get its commands back: a new process per move
+# with the JSON state on its command line, a persistent process reading
+# states from a pipe, and a persistent process on a shared-memory channel.
+# The AI is trivial, so the numbers are the cost of the handoff alone.
+#
+# Usage: bench_channels.py [moves]
+#
+
+import json
+import sys
+import time
+
+# The AIs only import what they need, so that the one-shot AI starts as fast
+# as it can.
+DONE_CMD = 'done'
+
+def trivial_ai(state, deadline):
+    return ['left']
+
+# The AI for the one-shot mode: the state is in argv.
+def argv_main(state):
+    json.loads(state)
+    print 'left'
+
+# The AI for the pipe mode, speaking the protocol of client.AIWorker.
+def pipe_main():
+    while True:
+        header = sys.stdin.readline()
+        if not header:
+            return
+        (seconds, length) = header.split()
+        json.loads(sys.stdin.read(int(length)))
+        sys.stdout.write('left\n%s\n' % DONE_CMD)
+        sys.stdout.flush()
+
+def game_states(moves):
+    from logic.Board import Board
+    board = Board(0)
+    states = []
+    while len(states) < moves:
+        states.append(board.to_dict())
+        board.send_commands(['left'] if len(states) % 2 else ['right'])
+        if board.state == 'failed':
+            board = Board(len(states))
+    return states
+
+# Times run(state) for each state, after one untimed call that starts the AI.
+def measure(name, states, run):
+    run(states[0])
+    times = []
+    for state in states:
+        start = time.time()
+        cmds = run(state)
+        times.append(time.time() - start)
+        assert cmds == ['left'], cmds
+    times.sort()
+    print '%-10s median %8.1f us, mean %8.1f us' % (
+        name, times[len(times)/2]*1e6, sum(times)/len(times)*1e6)
+
+def main(argv):
+    import client
+    from shm_channel import ShmWorker
+
+    moves = int(argv[1]) if len(argv) > 1 else 500
+    states = game_states(moves)
+    script = __file__
+
+    measure('argv-json', states[:max(moves/10, 1)], lambda state: client.Command(
+        sys.executable, script, 'argv', json.dumps(state)).run(timeout=10))
+
+    worker = client.AIWorker(sys.executable, script, 'pipe')
+    measure('pipe', states, lambda state: worker.run(json.dumps(state), '10', 10))
+    worker.stop()
+
+    channel = ShmWorker(sys.executable, 'shm_channel.py', 'bench_channels:trivial_ai')
+    measure('shm', states, lambda state: channel.run(state, 10, 10))
+    channel.stop()
+
+if __name__ == '__main__':
+    if len(sys.argv) > 1 and sys.argv[1] == 'argv':
+        argv_main(sys.argv[2])
+    elif len(sys.argv) > 1 and sys.argv[1] == 'pipe':
+        pipe_main()
+    else:
+        main(sys.argv)
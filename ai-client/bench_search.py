@@ -0,0 +1,70 @@
+#!/usr/bin/env python
+#
+# Compares ParallelSearch with BeamSearch at the same width and depth. Both
+# search every state of a game to full depth, without a deadline, so they do
+# the same work and must choose the same placements; the script checks that
+# they do and prints the time each takes per move. ParallelSearch is
+# experimental until this shows it faster on a machine with several cores.
+#
+# Usage: bench_search.py [moves] [width] [processes...]
+#
+
+import copy
+import multiprocessing
+import sys
+import time
+
+from helpers.beam_search import BeamSearch
+from helpers.parallel_search import ParallelSearch
+from logic.Board import Board
+
+# The states of a game played by the search, and the placements it chose.
+def play(search, moves):
+    board = Board(0)
+    states = []
+    lines = []
+    while len(states) < moves and board.state != 'failed':
+        # to_dict() shares the board's bitmap, which the next move changes.
+        state = copy.deepcopy(board.to_dict())
+        line = search.search(state, None)
+        if line is None:
+            break
+        states.append(state)
+        lines.append(line.placements)
+        board.send_commands(line.commands)
+    return (states, lines)
+
+def same_lines(a, b):
+    return [[(p.piece, p.commands) for p in line] for line in a] == \
+           [[(p.piece, p.commands) for p in line] for line in b]
+
+def measure(name, search, states, lines):
+    start = time.time()
+    hits = misses = 0
+    found = []
+    for state in states:
+        found.append(search.search(state, None).placements)
+        hits += search.hits
+        misses += search.misses
+    seconds = (time.time() - start)/len(states)
+    assert same_lines(found, lines), '%s chose other placements' % name
+    print '%-14s %8.1f ms per move, %d/%d heuristic values from the table' % (
+        name, seconds*1e3, hits, hits + misses)
+    return seconds
+
+def main(argv):
+    moves = int(argv[1]) if len(argv) > 1 else 50
+    width = int(argv[2]) if len(argv) > 2 else 8
+    counts = [int(arg) for arg in argv[3:]] or [multiprocessing.cpu_count()]
+
+    (states, lines) = play(BeamSearch(width=width), moves)
+    print '%d moves, width %d, %d CPUs' % (len(states), width, multiprocessing.cpu_count())
+    serial = measure('BeamSearch', BeamSearch(width=width), states, lines)
+    for processes in counts:
+        search = ParallelSearch(processes=processes, width=width)
+        seconds = measure('%d processes' % processes, search, states, lines)
+        search.close()
+        print '%-14s %8.2fx' % ('speedup', serial/seconds)
+
+if __name__ == '__main__':
+    main(sys.argv)
@@ -0,0 +1,57 @@
+#!/usr/bin/env python
+#
+# Checks that both state formats of encoding.py give back exactly the state
+# they were given, on every state of real local games: the states a
+# LocalServer answers with, up to and including the failed state it ends
+# the game with. The moves are random commands, which fill the board with
+# blocks of many types and lose in a few dozen moves.
+#
+# Usage: check_encoding.py [games]
+#
+# Exits with an AssertionError on the first state that does not round-trip.
+#
+
+import random
+import sys
+
+import encoding
+from client import (
+    FixedClock,
+    GameOverError,
+    LocalServer,
+    VALID_CMDS,
+)
+
+# The states of a game on a LocalServer with the given seed.
+def game_states(seed):
+    rng = random.Random(seed)
+    server = LocalServer(seed, clock=FixedClock(0))
+    game = server.get_local_game()
+    moves = 0
+    while True:
+        yield game['game']['game_state']
+        cmds = [rng.choice(VALID_CMDS) for k in range(rng.randint(0, 12))]
+        try:
+            game = server.submit_game_move(0, cmds, moves)
+        except GameOverError, e:
+            yield e.game_state_dict
+            return
+        moves += 1
+
+def main(argv):
+    games = int(argv[1]) if len(argv) > 1 else 20
+    states = 0
+    sizes = []
+    for seed in range(games):
+        for state in game_states(seed):
+            for format in encoding.FORMATS:
+                text = encoding.dumps(state, format)
+                assert encoding.loads(text, format) == state, (seed, format, state)
+            sizes.append(len(encoding.encode_state(state)))
+            states += 1
+        assert state['state'] == 'failed', state['state']
+    print '%d states of %d games round-trip in %s' % (states, games, ' and '.join(encoding.FORMATS))
+    print 'compact: %d bytes on average, %d at most' % (sum(sizes)//len(sizes), max(sizes))
+
+if __name__ == '__main__':
+    main(sys.argv)
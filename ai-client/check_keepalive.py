@@ -0,0 +1,158 @@
+#!/usr/bin/env python
+#
+# Checks DropbloxServer's connection handling against a stand-in HTTP/1.1
+# server on localhost that counts the connections it accepts:
+#
+#   - many requests share one keep-alive connection,
+#   - a connection the server dropped is replaced and the request retried,
+#   - a connection reset after the server read the request raises, and the
+#     request is not sent again,
+#   - a 401 raises AuthException,
+#   - a request that takes longer than its timeout raises socket.timeout,
+#     and the next request still works.
+#
+# Usage: check_keepalive.py [requests]
+#
+# Exits with an AssertionError on the first check that fails.
+#
+
+import BaseHTTPServer
+import json
+import socket
+import SocketServer
+import struct
+import sys
+import threading
+import time
+
+import client
+
+class StandInHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    # Answers are written in one piece, so that Nagle's algorithm does not
+    # hold back the body until the client acknowledges the headers.
+    wbufsize = -1
+
+    def setup(self):
+        BaseHTTPServer.BaseHTTPRequestHandler.setup(self)
+        with self.server.lock:
+            self.server.connections += 1
+
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+        with self.server.lock:
+            self.server.requests += 1
+            requests = self.server.requests
+        if self.server.reset_after_read:
+            # Reset the connection without answering, as a server that
+            # crashed while playing the move would.
+            self.connection.setsockopt(socket.SOL_SOCKET, socket.SO_LINGER,
+                                       struct.pack('ii', 1, 0))
+            self.connection.close()
+            self.close_connection = 1
+            return
+        time.sleep(self.server.delay)
+        if body['password'] != StandInServer.PASSWORD:
+            (status, out) = (401, '{}')
+        else:
+            (status, out) = (200, json.dumps({'ret': 'ok', 'path': self.path}))
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(out)))
+        self.end_headers()
+        self.wfile.write(out)
+        if self.server.drop_every and requests % self.server.drop_every == 0:
+            # Close without a Connection: close header, as a server whose idle
+            # timeout expired would.
+            self.close_connection = 1
+
+    def log_message(self, format, *args):
+        pass
+
+class StandInServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    PASSWORD = 'password'
+
+    # Clients that time out close their connection under the handler.
+    def handle_error(self, request, client_address):
+        pass
+
+    def __init__(self):
+        BaseHTTPServer.HTTPServer.__init__(self, ('127.0.0.1', 0), StandInHandler)
+        self.lock = threading.Lock()
+        self.delay = 0
+        self.drop_every = 0
+        self.reset_after_read = False
+        self.reset()
+
+    def reset(self):
+        self.connections = 0
+        self.requests = 0
+
+def main(argv):
+    num_requests = int(argv[1]) if len(argv) > 1 else 200
+    httpd = StandInServer()
+    thread = threading.Thread(target=httpd.serve_forever)
+    thread.daemon = True
+    thread.start()
+    port = httpd.server_address[1]
+    server = client.DropbloxServer('team', StandInServer.PASSWORD, '127.0.0.1', port, False)
+
+    started_at = time.time()
+    for k in range(num_requests):
+        assert server._request('/submit_game_move', {'k': k})['ret'] == 'ok'
+    assert httpd.connections == 1, httpd.connections
+    print 'keep-alive: %d requests on 1 connection, %.2f ms per request' % (
+        num_requests, (time.time() - started_at)/num_requests*1e3)
+
+    httpd.reset()
+    httpd.drop_every = 10
+    for k in range(100):
+        assert server._request('/submit_game_move', {'k': k})['ret'] == 'ok'
+    assert httpd.requests == 100, httpd.requests
+    # The first ten go on the connection opened above, and the last drop is
+    # not followed by another request.
+    assert httpd.connections == 9, httpd.connections
+    httpd.drop_every = 0
+    print 'reconnect: 100 requests on 9 new connections, dropped after every 10th'
+
+    # The last request above left a dropped connection; this one replaces it
+    # with a live one for the next request to reuse.
+    assert server._request('/x', {})['ret'] == 'ok'
+    httpd.reset()
+    httpd.reset_after_read = True
+    try:
+        server._request('/submit_game_move', {})
+        assert False, 'no error on reset'
+    except socket.error:
+        pass
+    httpd.reset_after_read = False
+    assert httpd.requests == 1, httpd.requests
+    assert server._request('/x', {})['ret'] == 'ok'
+    print 'reset: raised after the request was read, and not sent again'
+
+    try:
+        client.DropbloxServer('team', 'wrong', '127.0.0.1', port, False)._request('/x', {})
+        assert False, 'no AuthException on 401'
+    except client.AuthException:
+        print 'auth: 401 raised AuthException'
+
+    httpd.delay = 0.5
+    started_at = time.time()
+    try:
+        server._request('/x', {}, timeout=0.1)
+        assert False, 'no timeout'
+    except socket.timeout:
+        elapsed = time.time() - started_at
+        assert elapsed < 0.4, elapsed
+    httpd.delay = 0
+    assert server._request('/x', {})['ret'] == 'ok'
+    print 'timeout: raised after %.2f s, next request ok' % elapsed
+
+    # The handler threads end once their connections are closed.
+    for conn in server.idle:
+        conn.close()
+    httpd.shutdown()
+    print 'all checks passed'
+
+if __name__ == '__main__':
+    main(sys.argv)
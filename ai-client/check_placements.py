@@ -0,0 +1,76 @@
+#!/usr/bin/env python
+#
+# Checks PlacementCache against enumerate_placements() on the boards of real
+# local games, played by the greedy policy with the weights in weights.txt.
+# Every board is looked up with the current piece and each preview piece,
+# and the cache must give the same resting positions, with commands of the
+# same length that move the piece there.
+#
+# Prints the hit rate of the cache for boards that are their skyline, which
+# are keyed by the skyline within the piece's reach, and for boards with
+# holes a piece can get into, which are keyed by the whole board, and the
+# time a lookup takes against a full search.
+#
+# Usage: check_placements.py [games]
+#
+# Exits with an AssertionError on the first lookup that differs.
+#
+
+import sys
+import time
+
+from helpers.evaluator import (
+    GreedyPolicy,
+    load_weights,
+)
+from helpers.placements import (
+    PlacementCache,
+    enumerate_placements,
+    solid,
+    surface,
+)
+from helpers.search_board import SearchBoard
+from logic.Board import Board
+
+def positions(placements):
+    return dict(((p.piece.orientation, p.piece.i, p.piece.j), len(p.commands))
+                for p in placements)
+
+def main(argv):
+    games = int(argv[1]) if len(argv) > 1 else 4
+    policy = GreedyPolicy(load_weights('weights.txt'), placements=True)
+    caches = {'skyline': PlacementCache(), 'holes': PlacementCache()}
+    seconds = {'search': 0.0, 'cache': 0.0}
+    lookups = 0
+    for seed in range(1, games + 1):
+        board = Board(seed)
+        while board.state == 'playing':
+            state = board.to_dict()
+            search_board = SearchBoard(state['bitmap'])
+            for piece in [board.block] + board.preview:
+                kind = 'skyline' if solid(surface(search_board, piece)) else 'holes'
+                started_at = time.time()
+                expected = enumerate_placements(search_board, piece)
+                seconds['search'] += time.time() - started_at
+                started_at = time.time()
+                found = caches[kind].placements(search_board, piece)
+                seconds['cache'] += time.time() - started_at
+                lookups += 1
+                assert positions(found) == positions(expected), (seed, piece)
+                for placement in found:
+                    moved = board.move(piece, list(placement.commands))
+                    landed = moved.translate(i=search_board.rows_free(moved))
+                    assert landed == placement.piece, (seed, piece, placement)
+            placement = policy(state, None)
+            if not board.send_placement(placement.piece, placement.commands):
+                break
+    print '%d lookups on the boards of %d games match a full search' % (lookups, games)
+    for kind in ('skyline', 'holes'):
+        cache = caches[kind]
+        print '%-8s %5d lookups, %.0f%% from the cache' % (
+            kind, cache.hits + cache.misses, 100*cache.hit_rate)
+    print 'search %.2f ms per lookup, cache %.2f ms' % (
+        seconds['search']/lookups*1e3, seconds['cache']/lookups*1e3)
+
+if __name__ == '__main__':
+    main(sys.argv)
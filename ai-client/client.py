@@ -9,20 +9,27 @@
 # back the move list.
 #
 
-import contextlib
+import copy
 import hashlib
+import httplib
 import os
 import platform
+import Queue
+import select
+import socket
 import sys
 import threading
 import time
-import urllib2
+import traceback
 from subprocess import Popen, PIPE
 
 import json
 
+import encoding
 import messaging
 import util
+from shm_channel import ShmWorker
+from helpers.placements import Placement
 from logic.Board import Board
 
 # Remote server to connect to:
@@ -39,43 +46,286 @@ UP_CMD = 'up'
 DOWN_CMD = 'down'
 ROTATE_CMD = 'rotate'
 VALID_CMDS = [LEFT_CMD, RIGHT_CMD, UP_CMD, DOWN_CMD, ROTATE_CMD]
+DONE_CMD = 'done' # Ends each move in worker mode
 AI_PROCESS_PATH = os.path.join(os.getcwd(), 'dropblox_ai' if not is_windows else 'dropblox_ai.bat')
+SHM_CHANNEL_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'shm_channel.py')
 
 # Printing utilities
 colorred = "\033[01;31m{0}\033[00m" if not is_windows else "{0}"
 colorgrn = "\033[1;36m{0}\033[00m" if not is_windows else "{0}"
 
+# Seconds to wait for the game server on each request, and the number of
+# unused keep-alive connections to it that are kept open.
+REQUEST_TIMEOUT = 30
+MAX_IDLE_CONNECTIONS = 4
+
 # Logging AI actions for debug webserver
 LOGGING_DIR = os.path.join(os.getcwd(), 'history')
 
+# Seconds an AI gets to exit after it is told to stop, before it is killed,
+# and to flush what it wrote before that.
+KILL_GRACE = 0.05
+
+# Parses the commands an AI writes to its stdout as they arrive. Reads wait
+# in select() until there is output or the deadline passes, so no thread is
+# needed and the client wakes up as soon as the AI answers. select() only
+# works on sockets on Windows, so there a thread reads the pipe instead.
+class CommandReader(object):
+    def __init__(self, stream):
+        self.stream = stream
+        self.buffer = ''
+        self.eof = False
+        if is_windows:
+            self.chunks = Queue.Queue()
+            def target():
+                for line in iter(stream.readline, ''):
+                    self.chunks.put(line)
+                self.chunks.put('')
+
+            thread = threading.Thread(target=target)
+            thread.daemon = True
+            thread.start()
+
+    # Returns the next chunk of output, '' at the end of the stream, or None
+    # if there was none before the timeout.
+    def read_chunk(self, timeout):
+        if is_windows:
+            try:
+                return self.chunks.get(timeout=timeout)
+            except Queue.Empty:
+                return None
+        (ready, _, _) = select.select([self.stream], [], [], timeout)
+        if not ready:
+            return None
+        return os.read(self.stream.fileno(), 4096)
+
+    # Adds the AI's commands to cmds until it writes DONE_CMD or closes its
+    # stdout, and returns True, or until the deadline, and returns False.
+    def read(self, cmds, deadline):
+        while True:
+            while '\n' in self.buffer:
+                (line, self.buffer) = self.buffer.split('\n', 1)
+                if self.parse(line.rstrip('\r'), cmds):
+                    return True
+            if self.eof:
+                return True
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                return False
+            chunk = self.read_chunk(remaining)
+            if chunk is None:
+                return False
+            if not chunk:
+                # A last line may be missing its newline.
+                self.eof = True
+                chunk = '\n'
+            self.buffer += chunk
+
+    # Adds the line to cmds if it is a command. Returns True if it ends the
+    # move.
+    def parse(self, line, cmds):
+        if line == DONE_CMD:
+            return True
+        if line in VALID_CMDS:
+            cmds.append(line)
+        elif line:
+            print 'INVALID COMMAND:', line # Forward debug output to terminal
+        return False
+
+# Terminates the process, and kills it if it has not exited KILL_GRACE
+# seconds later.
+def stop_process(process):
+    try:
+        if process.poll() is None:
+            process.terminate()
+        killed_at = time.time() + KILL_GRACE
+        while process.poll() is None:
+            if time.time() >= killed_at:
+                process.kill()
+                process.wait()
+                break
+            time.sleep(0.001)
+    except OSError:
+        pass
+
 class Command(object):
     def __init__(self, cmd, *args):
         self.cmd = cmd
         self.args = list(args)
 
+    # AIs are started with close_fds on POSIX, so that they do not inherit
+    # the pipes of AIs started for games on other threads. An inherited
+    # stdin would keep a worker from seeing its own close. Python 2 cannot
+    # close them on Windows when the standard streams are redirected.
     def run(self, timeout):
         cmds = []
-        is_windows = platform.system() == "Windows"
-        process = Popen([self.cmd] + self.args, stdout=PIPE, universal_newlines=True, shell=is_windows)
-        def target():
-            for line in iter(process.stdout.readline, ''):
-                line = line.rstrip('\n')
-                if line not in VALID_CMDS:
-                    print 'INVALID COMMAND:', line # Forward debug output to terminal
-                else:
-                    cmds.append(line)
-
-        thread = threading.Thread(target=target)
-        thread.start()
+        process = Popen([self.cmd] + self.args, stdout=PIPE, shell=is_windows,
+                        close_fds=not is_windows)
+        reader = CommandReader(process.stdout)
+        if reader.read(cmds, time.time() + timeout):
+            # The AI is done and exiting. It is not waited for; the subprocess
+            # module reaps it when the next AI is started.
+            if process.poll() is None:
+                try:
+                    process.terminate()
+                except OSError:
+                    pass
+        else:
+            # print colorred.format('Terminating process')
+            stop_process(process)
+            # Commands the AI wrote before it was stopped still count.
+            reader.read(cmds, time.time() + KILL_GRACE)
+        process.stdout.close()
+        # print colorgrn.format('commands received: %s' % cmds)
+        return cmds
 
-        thread.join(timeout)
-        # print colorred.format('Terminating process')
+# An AI process that is started once and asked for one move at a time,
+# instead of a new process per move. Each request is written to the AI's stdin
+# as a header line, with the seconds remaining and the length of the game
+# state JSON, followed by the JSON itself. The AI prints its commands one per
+# line and then DONE_CMD.
+#
+# If the AI crashes, or does not finish a move before the timeout, the
+# commands it printed so far are used and it is restarted for the next move.
+class AIWorker(object):
+    def __init__(self, cmd, *args):
+        self.cmd = cmd
+        self.args = list(args)
+        self.process = None
+        self.reader = None
+        # Where the AI's stderr goes: a file, or None for the client's own.
+        self.stderr = None
+        # The AI's environment, or None for the client's own.
+        self.env = None
+
+    def start(self):
+        self.process = Popen([self.cmd] + self.args, stdin=PIPE, stdout=PIPE,
+                             stderr=self.stderr, env=self.env, shell=is_windows,
+                             close_fds=not is_windows)
+        self.reader = CommandReader(self.process.stdout)
+
+    def stop(self):
+        if self.process is None:
+            return
+        stop_process(self.process)
+        self.process.stdout.close()
+        self.process = None
+
+    def run(self, game_state, seconds, timeout):
+        if self.process is None or self.process.poll() is not None:
+            self.stop()
+            self.start()
+        cmds = []
         try:
-            process.terminate()
-            thread.join(60)
-        except Exception:
-            pass
-        # print colorgrn.format('commands received: %s' % cmds)
+            self.process.stdin.write('%s %d\n%s' % (seconds, len(game_state), game_state))
+            self.process.stdin.flush()
+        except IOError:
+            self.stop()
+            return cmds
+
+        if not self.reader.read(cmds, time.time() + timeout) or self.reader.eof:
+            # print colorred.format('AI timed out or exited, restarting it')
+            self.stop()
+        return cmds
+
+# A Python AI that runs inside the client, without a process or JSON in
+# between. `spec` is "module:callable", and the callable is called with the
+# game state dict and a util.Deadline and returns a list of commands.
+#
+# The AI is expected to return before the deadline by itself. It is called on
+# a worker thread that lasts as long as the plugin, so that one that does not
+# is abandoned once the timeout passes: no commands are made that move, as if
+# its process had been killed. The thread makes one call at a time, so the
+# AI need not be reentrant: the next move waits for the abandoned call to
+# return before it starts, and its deadline runs meanwhile. Each call is
+# numbered, and the results of abandoned calls are dropped.
+#
+# The client waits in select() on a pipe that the worker writes a byte to
+# after each call, so it wakes up as soon as the AI returns. select() only
+# works on sockets on Windows, so there it waits on the queue of results.
+class AIPlugin(object):
+    def __init__(self, spec):
+        self.ai = util.load_callable(spec)
+        self.requests = None
+
+    def start(self):
+        self.requests = Queue.Queue()
+        self.results = Queue.Queue()
+        self.calls = 0
+        if is_windows:
+            (self.wakeups, wake) = (None, None)
+        else:
+            (self.wakeups, wake) = os.pipe()
+        self.thread = threading.Thread(target=self.serve,
+                                       args=(self.requests, self.results, self.wakeups, wake))
+        self.thread.daemon = True
+        self.thread.start()
+
+    def serve(self, requests, results, wakeups, wake):
+        while True:
+            request = requests.get()
+            if request is None:
+                break
+            (call, args) = request
+            try:
+                results.put((call, self.ai(*args) or []))
+            except Exception:
+                traceback.print_exc()
+                results.put((call, []))
+            if wake is not None:
+                os.write(wake, 'x')
+        if wake is not None:
+            os.close(wakeups)
+            os.close(wake)
+
+    # Ends the worker thread once its call, if any, returns. The client waits
+    # KILL_GRACE seconds for it to exit, so that it does not outlive the
+    # interpreter.
+    def stop(self):
+        if self.requests is not None:
+            self.requests.put(None)
+            self.requests = None
+            self.thread.join(KILL_GRACE)
+
+    # Returns the commands of the given call, or None if it does not return
+    # before the deadline.
+    def wait(self, call, deadline):
+        while True:
+            try:
+                (done, ai_cmds) = self.results.get_nowait()
+            except Queue.Empty:
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    return None
+                if self.wakeups is None:
+                    try:
+                        (done, ai_cmds) = self.results.get(timeout=remaining)
+                    except Queue.Empty:
+                        return None
+                else:
+                    (ready, _, _) = select.select([self.wakeups], [], [], remaining)
+                    if ready:
+                        os.read(self.wakeups, 4096)
+                    continue
+            if done == call:
+                return ai_cmds
+
+    def run(self, game_state_dict, timeout):
+        if self.requests is None:
+            self.start()
+        self.calls += 1
+        self.requests.put((self.calls, (game_state_dict, util.Deadline(timeout))))
+        ai_cmds = self.wait(self.calls, time.time() + timeout)
+        if ai_cmds is None:
+            # print colorred.format('AI timed out, abandoning it')
+            return []
+
+        cmds = []
+        for cmd in ai_cmds:
+            if cmd not in VALID_CMDS:
+                print 'INVALID COMMAND:', cmd
+            else:
+                cmds.append(cmd)
         return cmds
 
 class GameStateLogger(object):
@@ -117,30 +367,77 @@ class DropbloxServer(object):
 
         self.team_name = team_name
         self.team_password = team_password
-        
-    def _request(self, path, tbd):
-        schema = 'https' if self.ssl else 'http'
-        url = '%s://%s:%d%s' % (schema, self.host, self.port, path)
-        
+
+        # Keep-alive connections that are not in use by a request.
+        self.idle = []
+        self.idle_lock = threading.Lock()
+
+    def _connect(self, timeout):
+        if self.ssl:
+            return httplib.HTTPSConnection(self.host, self.port, timeout=timeout)
+        return httplib.HTTPConnection(self.host, self.port, timeout=timeout)
+
+    # Requests are sent over HTTP/1.1 keep-alive connections, which are kept
+    # for the next request unless the server closes them. A kept connection
+    # may have been closed by the server while it was idle. The request is
+    # then sent again on a new connection, but only if it cannot have been
+    # played: sending it failed, or the server closed the connection without
+    # a status line. Any other error once it was sent is raised, since a
+    # move sent twice would be played twice.
+    def _request(self, path, tbd, timeout=REQUEST_TIMEOUT):
         tbd = dict(tbd)
         tbd['team_name'] = self.team_name
         tbd['password'] = self.team_password
         data = json.dumps(tbd)
 
-        req = urllib2.Request(url, data, {
-                'Content-Type': 'application/json'
-                })
+        while True:
+            with self.idle_lock:
+                conn = self.idle.pop() if self.idle else None
+            reused = conn is not None
+            if conn is None:
+                conn = self._connect(timeout)
+            try:
+                conn.timeout = timeout
+                if conn.sock is not None:
+                    conn.sock.settimeout(timeout)
+                conn.request('POST', path, data, {
+                        'Content-Type': 'application/json'
+                        })
+            except socket.timeout:
+                conn.close()
+                raise
+            except (httplib.HTTPException, socket.error):
+                conn.close()
+                if reused:
+                    continue
+                raise
+            try:
+                resp = conn.getresponse()
+                body = resp.read()
+            except httplib.BadStatusLine:
+                conn.close()
+                if reused:
+                    continue
+                raise
+            except (httplib.HTTPException, socket.error):
+                conn.close()
+                raise
+            break
 
-        try:
-            with contextlib.closing(urllib2.urlopen(req)) as resp:
-                if resp.getcode() != 200:
-                    raise Exception("Bad response: %r" % resp.getcode())
-                return json.loads(resp.read())
-        except urllib2.HTTPError, err:
-           if err.code == 401:
-               raise AuthException()
-           else:
-               raise
+        if resp.will_close:
+            conn.close()
+        else:
+            with self.idle_lock:
+                if len(self.idle) < MAX_IDLE_CONNECTIONS:
+                    self.idle.append(conn)
+                else:
+                    conn.close()
+
+        if resp.status == 401:
+            raise AuthException()
+        if resp.status != 200:
+            raise Exception("Bad response: %r" % resp.status)
+        return json.loads(body)
 
     def create_practice_game(self):
         return self._request("/create_practice_game", {})
@@ -168,37 +465,110 @@ class DropbloxServer(object):
         
         raise Exception("Bad response: %r" % (resp,))
 
+# The clocks a LocalServer can charge moves against. start() is called when
+# a game starts, move() when a move is submitted and answered() when the
+# server has answered it; elapsed() is the game time used so far.
+#
+# WallClock is the real time since the game started, as on the server. The
+# other two only charge the time the AI spends on each move, so that a game
+# plays the same however many others run beside it.
+class WallClock(object):
+    def start(self):
+        self.started_at = time.time()
+
+    def move(self):
+        pass
+
+    def answered(self):
+        pass
+
+    def elapsed(self):
+        return time.time() - self.started_at
+
+# Charges each move the CPU time used between the server's answer and the
+# move: the client's own, and that of the AI processes reaped in the
+# meantime. Plugins are counted in full. A one-shot AI is reaped when the
+# next one starts, so its time is charged one move late. AI processes that
+# stay running (--worker, --shm) are not counted until they exit, so use a
+# FixedClock with those. CPU time is counted for the whole process, so with
+# plugins, games running on other threads are charged as well.
+class CpuClock(object):
+    def start(self):
+        self.used = 0.0
+        self.answered()
+
+    def move(self):
+        self.used += cpu_seconds() - self.mark
+
+    def answered(self):
+        self.mark = cpu_seconds()
+
+    def elapsed(self):
+        return self.used
+
+def cpu_seconds():
+    (user, system, children_user, children_system, _) = os.times()
+    return user + system + children_user + children_system
+
+# Charges every move the same number of seconds.
+class FixedClock(object):
+    def __init__(self, seconds):
+        self.seconds = seconds
+
+    def start(self):
+        self.used = 0.0
+
+    def move(self):
+        self.used += self.seconds
+
+    def answered(self):
+        pass
+
+    def elapsed(self):
+        return self.used
+
 class LocalServer(object):
-    def __init__(self, seed):
+    def __init__(self, seed, timeout=util.AI_CLIENT_TIMEOUT, clock=None):
       self.seed = seed
+      self.timeout = timeout
+      self.clock = clock if clock is not None else WallClock()
     def submit_game_move(self, game_id, move_list, moves_made):
         # update local state, return json object
         game_state = self.game
         made_move = False
         if game_state.state != 'failed':
-            if time.time() - self.game.game_started_at > util.AI_CLIENT_TIMEOUT:
+            self.clock.move()
+            if self.clock.elapsed() > self.timeout:
                 game_state.state = 'failed'
+            elif isinstance(move_list, Placement):
+                # A placement from an AI in this process (see batch.py),
+                # played in one step.
+                if not game_state.send_placement(move_list.piece, move_list.commands):
+                    raise Exception("Bad move: unreachable placement %r" % (move_list,))
+                made_move = True
             else:
-                game_state.send_commands(move_list)
+                game_state.send_commands(list(move_list))
                 made_move = True
         game_state.total_steps += int(bool(made_move))
 
         if game_state.state == 'failed':
             raise GameOverError(game_state.to_dict())
-        return dict(
+        answer = dict(
             ret='ok',
             game=dict(
                 id=0,
                 number_moves_made=game_state.total_steps,
                 game_state=game_state.to_dict(),
             ),
-            competition_seconds_remaining=util.AI_CLIENT_TIMEOUT - (time.time() - self.game.game_started_at) - 1,
+            competition_seconds_remaining=self.timeout - self.clock.elapsed() - 1,
             )
+        self.clock.answered()
+        return answer
 
     def get_local_game(self):
         # return a json object
         self.game = Board(self.seed)
-        self.game.game_started_at = time.time()
+        self.clock.start()
         self.game.game_id = 0
         self.game.total_steps = 0
         return dict(
@@ -208,47 +578,183 @@ class LocalServer(object):
                 number_moves_made=self.game.total_steps,
                 game_state=self.game.to_dict(),
             ),
-            competition_seconds_remaining=util.AI_CLIENT_TIMEOUT-1,
+            competition_seconds_remaining=self.timeout-1,
             )
 
+# Set by main() when the AI runs in worker mode, over shared memory or as a
+# plugin.
+ai_worker = None
+ai_channel = None
+ai_plugin = None
+# The encoding of the game state handed to AI processes; see encoding.py.
+state_format = 'json'
+
+# Set by main() to have run_game() compute each move while the previous one
+# is being submitted. The AI is then shown only the first speculate_preview
+# blocks of the preview on every move, or all but the last if it is None,
+# since the block the server draws next cannot be predicted.
+speculate = False
+speculate_preview = None
+
+# The AIs above are copied for each thread that plays a game, so that games
+# played at the same time by run_practice_games() do not share one.
+ai_threads = threading.local()
+
+def thread_ai(template):
+    if template is None:
+        return None
+    if not hasattr(ai_threads, 'ais'):
+        ai_threads.ais = {}
+    if id(template) not in ai_threads.ais:
+        ai_threads.ais[id(template)] = copy.copy(template)
+    return ai_threads.ais[id(template)]
+
+def stop_thread_ais():
+    for ai in getattr(ai_threads, 'ais', {}).values():
+        ai.stop()
+    ai_threads.ais = {}
+
 def run_ai(game_state_dict, seconds_remaining, logger=None):
-    ai_arg_one = json.dumps(game_state_dict)
-    ai_arg_two = json.dumps(seconds_remaining)
     if logger is not None:
-        logger.log_game_state(ai_arg_one)
-    command = Command(AI_PROCESS_PATH, ai_arg_one, ai_arg_two, sys.argv[3])
-    ai_cmds = command.run(timeout=float(ai_arg_two))
+        logger.log_game_state(json.dumps(game_state_dict))
+    timeout = float(seconds_remaining)
+    if ai_plugin is not None:
+        ai_cmds = thread_ai(ai_plugin).run(game_state_dict, timeout)
+    elif ai_channel is not None:
+        ai_cmds = thread_ai(ai_channel).run(game_state_dict, seconds_remaining, timeout)
+    else:
+        ai_arg_one = encoding.dumps(game_state_dict, state_format)
+        ai_arg_two = json.dumps(seconds_remaining)
+        if ai_worker is not None:
+            ai_cmds = thread_ai(ai_worker).run(ai_arg_one, ai_arg_two, timeout)
+        else:
+            command = Command(AI_PROCESS_PATH, ai_arg_one, ai_arg_two, sys.argv[3])
+            ai_cmds = command.run(timeout=timeout)
     if logger is not None:
         logger.log_ai_move(json.dumps(ai_cmds))
     return ai_cmds
 
-def run_game(server, game, use_logger=True):
+# Runs calls one at a time on a thread of its own. call() starts one, and
+# result() waits for it to finish and returns its value, or raises its
+# exception. stop() ends the thread once the calls before it are done.
+class Background(object):
+    def __init__(self):
+        self.calls = Queue.Queue()
+        self.results = Queue.Queue()
+        thread = threading.Thread(target=self.serve)
+        thread.daemon = True
+        thread.start()
+
+    def serve(self):
+        while True:
+            call = self.calls.get()
+            if call is None:
+                return
+            (function, args) = call
+            try:
+                self.results.put((True, function(*args)))
+            except Exception:
+                self.results.put((False, sys.exc_info()))
+
+    def call(self, function, *args):
+        self.calls.put((function, args))
+
+    def result(self):
+        (ok, value) = self.results.get()
+        if not ok:
+            raise value[0], value[1], value[2]
+        return value
+
+    def stop(self):
+        self.calls.put(None)
+
+# The state with only the first `preview` blocks of its preview.
+def preview_state(game_state_dict, preview):
+    state = dict(game_state_dict)
+    state['preview'] = game_state_dict['preview'][:preview]
+    return state
+
+# The state the server should answer with after the commands are played,
+# with only the first `preview` blocks of its preview. The block after the
+# current preview is drawn by the server, so `preview` must be shorter than
+# the current preview for the prediction to be complete. Returns None if the
+# move loses.
+def predict_state(game_state_dict, cmds, preview):
+    board = Board.from_dict(game_state_dict)
+    board.send_commands(list(cmds))
+    if board.state != 'playing':
+        return None
+    return preview_state(board.to_dict(), preview)
+
+# Plays the game to the end and returns (score, moves made). Unless report is
+# False, the results are also printed for run_trials.py to read.
+#
+# With speculate set, each move is submitted on another thread, and while
+# the server answers, the AI is already run on the predicted next state. The
+# AI is given the same shortened preview on every move, so the commands it
+# returns are played next only if the server's answer, shortened the same
+# way, is the state it was given, and are thrown away otherwise.
+def run_game(server, game, use_logger=True, report=True):
     game_id = game['game']['id']
     moves_made = game['game']['number_moves_made']
 
     logger = GameStateLogger(game_id) if use_logger else None
-
-    while True:
-        ai_cmds = run_ai(game['game']['game_state'],
-                         game['competition_seconds_remaining'],
-                         logger=logger)
-
-        try:
-            game = server.submit_game_move(game_id, ai_cmds, moves_made)
-        except GameOverError, e:
-            final_game_state_dict = e.game_state_dict
-            break
-        moves_made += 1
-        # print 'moves_made:', moves_made, 'score:', game['game']['game_state']['score'],
-        # print 'seconds_remaining:', game['competition_seconds_remaining']
+    predicted = None
+    hits = 0
+    if speculate:
+        preview = len(game['game']['game_state']['preview']) - 1
+        if speculate_preview is not None:
+            preview = min(speculate_preview, preview)
+        background = Background()
+
+    try:
+        while True:
+            game_state_dict = game['game']['game_state']
+            if speculate:
+                game_state_dict = preview_state(game_state_dict, preview)
+            if predicted is not None and predicted == game_state_dict:
+                ai_cmds = predicted_cmds
+                hits += 1
+                if logger is not None:
+                    logger.log_game_state(json.dumps(game_state_dict))
+                    logger.log_ai_move(json.dumps(ai_cmds))
+            else:
+                ai_cmds = run_ai(game_state_dict,
+                                 game['competition_seconds_remaining'],
+                                 logger=logger)
+
+            try:
+                if speculate:
+                    # LocalServer keeps changing the bitmap it answered with,
+                    # so the prediction is made before the move is submitted.
+                    predicted = predict_state(game['game']['game_state'], ai_cmds, preview)
+                    background.call(server.submit_game_move, game_id, list(ai_cmds), moves_made)
+                    if predicted is not None:
+                        predicted_cmds = run_ai(predicted, game['competition_seconds_remaining'])
+                    game = background.result()
+                else:
+                    game = server.submit_game_move(game_id, ai_cmds, moves_made)
+            except GameOverError, e:
+                final_game_state_dict = e.game_state_dict
+                break
+            moves_made += 1
+            # print 'moves_made:', moves_made, 'score:', game['game']['game_state']['score'],
+            # print 'seconds_remaining:', game['competition_seconds_remaining']
+    finally:
+        if speculate:
+            background.stop()
 
     if logger is not None:
         logger.log_game_state(json.dumps(final_game_state_dict))
 
     # print colorgrn.format("Game over! Your score was: %s" %
     #                       (final_game_state_dict['score'],))
-    print "RESULTS: %s" % final_game_state_dict['score']
-    print "RESULTS_TIME: %s" % moves_made
+    if report:
+        print "RESULTS: %s" % final_game_state_dict['score']
+        print "RESULTS_TIME: %s" % moves_made
+        if speculate:
+            print "SPECULATED: %s" % hits
+    return (final_game_state_dict['score'], moves_made)
 
 def run_compete(server):
     # TODO: it might be better for this to be an actual game object
@@ -277,15 +783,100 @@ def run_practice(server):
     new_game = server.create_practice_game()
     run_game(server, new_game)
 
-def run_local(seed):
+# Plays num_games practice games, at most `concurrency` of them at a time,
+# and reports each one as it finishes. Python 2 has no asyncio, so each game
+# runs on its own thread; the threads spend nearly all their time waiting on
+# AI processes and the server, which they do in parallel.
+def run_practice_games(server, num_games, concurrency):
+    results = Queue.Queue()
+    slots = threading.Semaphore(concurrency)
+    def play(k):
+        with slots:
+            try:
+                new_game = server.create_practice_game()
+                results.put((k, run_game(server, new_game, use_logger=False, report=False)))
+            except Exception, e:
+                results.put((k, e))
+            finally:
+                stop_thread_ais()
+
+    started_at = time.time()
+    for k in range(num_games):
+        thread = threading.Thread(target=play, args=(k,))
+        thread.daemon = True
+        thread.start()
+
+    scores = []
+    for finished in range(1, num_games + 1):
+        # Waiting in short steps keeps Ctrl-C working.
+        while True:
+            try:
+                (k, result) = results.get(timeout=1)
+                break
+            except Queue.Empty:
+                pass
+        if isinstance(result, Exception):
+            print colorred.format("Game %d failed (%d/%d): %r" % (k, finished, num_games, result))
+            continue
+        (score, moves_made) = result
+        scores.append(score)
+        print "GAME %d RESULTS: %s in %s moves (%d/%d)" % (k, score, moves_made, finished, num_games)
+
+    elapsed = time.time() - started_at
+    if scores:
+        print "RESULTS: %s" % (float(sum(scores))/len(scores))
+        print "RESULTS_RANGE: %s %s" % (min(scores), max(scores))
+    print "GAMES: %d of %d in %.1f seconds (%.2f per minute)" % (
+        len(scores), num_games, elapsed, 60*len(scores)/elapsed)
+
+def run_local(seed, clock=None):
     # create practice games, run game
     print "running local"
-    server = LocalServer(seed)
+    server = LocalServer(seed, clock=clock)
     run_game(server, server.get_local_game())
 
 def main(argv):
+    global ai_worker, ai_channel, ai_plugin, state_format, speculate, speculate_preview
+    num_games = 1
+    concurrency = None
+    clock = None
+    flags = [arg for arg in argv if arg.startswith('--')]
+    argv[:] = [arg for arg in argv if not arg.startswith('--')]
+    for flag in flags:
+        if flag == '--worker':
+            # The worker exits by itself when the client exits and closes its stdin.
+            ai_worker = AIWorker(AI_PROCESS_PATH, '--worker', *argv[3:4])
+        elif flag.startswith('--shm='):
+            # A Python AI, served over shared memory by shm_channel.py in a
+            # process of its own.
+            ai_channel = ShmWorker(sys.executable, SHM_CHANNEL_PATH, flag[len('--shm='):])
+        elif flag.startswith('--plugin='):
+            ai_plugin = AIPlugin(flag[len('--plugin='):])
+        elif flag.startswith('--format='):
+            state_format = flag[len('--format='):]
+            if state_format not in encoding.FORMATS:
+                print colorred.format("Unknown state format: %s" % state_format)
+                sys.exit(0)
+        elif flag == '--speculate':
+            speculate = True
+        elif flag.startswith('--speculate='):
+            speculate = True
+            speculate_preview = int(flag[len('--speculate='):])
+        elif flag.startswith('--clock='):
+            clock = flag[len('--clock='):]
+            if clock == 'wall':
+                clock = WallClock()
+            elif clock == 'cpu':
+                clock = CpuClock()
+            else:
+                clock = FixedClock(float(clock))
+        elif flag.startswith('--games='):
+            num_games = int(flag[len('--games='):])
+        elif flag.startswith('--concurrency='):
+            concurrency = int(flag[len('--concurrency='):])
+
     if len(argv) < 2:
-        print colorred.format("Usage: client.py [compete|practice|local] <seed>")
+        print colorred.format("Usage: client.py [compete|practice|local] <seed> <weights> [--worker|--shm=module:callable|--plugin=module:callable] [--format=json|compact] [--games=N] [--concurrency=N] [--speculate[=N]] [--clock=wall|cpu|<seconds per move>]")
         sys.exit(0)
 
     seed = None
@@ -312,7 +903,10 @@ def main(argv):
         server = DropbloxServer(team_name, team_password, *connect_details)
 
         try:
-            if entry_mode == "practice":
+            if entry_mode == "practice" and num_games > 1:
+                run_practice_games(server, num_games, concurrency or num_games)
+                return 0
+            elif entry_mode == "practice":
                 run_practice(server)
                 return 0
             elif entry_mode == "compete":
@@ -322,8 +916,13 @@ def main(argv):
                 assert False, 'wtf? mode = %s' % entry_mode
         except AuthException:
             print colorred.format("Cannot authenticate, please check config.txt")
+        finally:
+            stop_thread_ais()
     elif entry_mode == 'local':
-        run_local(seed)
+        try:
+            run_local(seed, clock)
+        finally:
+            stop_thread_ais()
         return 0
 
 if __name__ == '__main__':
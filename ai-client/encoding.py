@@ -0,0 +1,105 @@
+#!/usr/bin/env python
+#
+# A compact encoding of the game state handed to the AI, as an alternative
+# to the JSON of Board.to_dict(). Rows are packed as 12-bit masks, and blocks
+# are given by type, orientation and center; their offsets are looked up in
+# the block catalog in logic.Block, which both sides share. The value of
+# every occupied square (its block type + 1) follows the blocks, so that
+# decode_state(encode_state(state)) == state. check_encoding.py checks this
+# on the states of real games.
+#
+
+import base64
+import json
+import struct
+
+from logic.Bitboard import rows_from_bitmap
+from logic.Block import (
+    COLS,
+    ROWS,
+)
+from logic.Piece import Piece
+
+FORMATS = ('json', 'compact')
+
+VERSION = 2
+
+# Version, score, number of preview blocks and length of the state string,
+# which follows.
+HEADER = struct.Struct('<BIBB')
+ROW_MASKS = struct.Struct('<%dH' % ROWS)
+# Type, orientation index and center (i, j).
+PIECE = struct.Struct('<HBbb')
+# The value of an occupied square.
+SQUARE = 'H'
+
+# The squares of every row mask, for building bitmaps, and their number.
+ROW_SQUARES = [tuple((mask >> j) & 1 for j in range(COLS)) for mask in range(1 << COLS)]
+ROW_COUNTS = [sum(squares) for squares in ROW_SQUARES]
+
+def encode_state(state):
+    block = Piece.from_dict(state['block'])
+    preview = [Piece.from_dict(b) for b in state['preview']]
+    name = state['state'].encode('utf-8')
+    rows = rows_from_bitmap(state['bitmap'])
+    squares = [value for row in state['bitmap'] for value in row if value]
+    parts = [
+        HEADER.pack(VERSION, state['score'], len(preview), len(name)),
+        name,
+        ROW_MASKS.pack(*rows),
+    ]
+    for piece in [block] + preview:
+        parts.append(PIECE.pack(piece.type, piece.orientation, piece.i, piece.j))
+    parts.append(struct.pack('<%d%s' % (len(squares), SQUARE), *squares))
+    return ''.join(parts)
+
+# Returns (state, score, rows, block, preview, offset) from an encoded state,
+# where offset is that of the square values.
+def unpack_header(data):
+    (version, score, num_preview, name_length) = HEADER.unpack_from(data, 0)
+    if version != VERSION:
+        raise ValueError('Unknown state encoding version: %r' % (version,))
+    offset = HEADER.size
+    state = data[offset:offset + name_length].decode('utf-8')
+    offset += name_length
+    rows = ROW_MASKS.unpack_from(data, offset)
+    offset += ROW_MASKS.size
+    pieces = []
+    for k in range(num_preview + 1):
+        pieces.append(Piece(*PIECE.unpack_from(data, offset)))
+        offset += PIECE.size
+    return (state, score, rows, pieces[0], pieces[1:], offset)
+
+# Returns (state, score, rows, block, preview) from an encoded state, where
+# rows are the row masks and the blocks are Pieces. AIs that work on row
+# masks can use this and skip building the bitmap and block dicts.
+def unpack_state(data):
+    return unpack_header(data)[:5]
+
+def decode_state(data):
+    (state, score, rows, block, preview, offset) = unpack_header(data)
+    count = sum(ROW_COUNTS[row] for row in rows)
+    values = iter(struct.unpack_from('<%d%s' % (count, SQUARE), data, offset))
+    bitmap = []
+    for row in rows:
+        if row:
+            bitmap.append([next(values) if square else 0 for square in ROW_SQUARES[row]])
+        else:
+            bitmap.append([0]*COLS)
+    return {
+        'state': state,
+        'bitmap': bitmap,
+        'block': block.to_dict(),
+        'preview': [piece.to_dict() for piece in preview],
+        'score': score,
+    }
+
+def dumps(state, format='json'):
+    if format == 'compact':
+        return base64.b64encode(encode_state(state))
+    return json.dumps(state)
+
+def loads(text, format='json'):
+    if format == 'compact':
+        return decode_state(base64.b64decode(text))
+    return json.loads(text)
@@ -1,10 +1,22 @@
-import subprocess
-import random
-import re
-import tempfile
+import multiprocessing
 import os
-import threading
+import random
 import sys
+import tempfile
+
+from batch import (
+    BatchSimulator,
+    WorkerPolicy,
+)
+from client import (
+    CpuClock,
+    FixedClock,
+)
+from helpers.evaluator import (
+    GreedyPolicy,
+    LookaheadPolicy,
+    weight_vector,
+)
 
 chromosome_seed = {
         # 'BLOCK_EDGES': 0.7277,
@@ -35,27 +47,52 @@ def generate_random_chromosome(seed=chromosome_seed, sd=1):
 
     return Chromosome(new_chromosome)
 
-def run_trial(chromosome, seed=random.randint(0, 1024)):
-    # print 'running trial with seed ' + str(seed)
+# The AI that plays the chromosomes. By default it is LookaheadPolicy, the
+# C++ AI's search run in this process; --greedy selects the faster
+# GreedyPolicy. Both are charged their CPU time. --worker plays the C++ AI
+# itself, one worker process per chromosome.
+policy_name = 'lookahead'
+
+# The seconds a worker game is charged per move. The pool already runs a
+# chromosome per CPU, so each worker runs its OpenMP loops on one thread,
+# and a FixedClock keeps the games from timing out on a busy machine.
+WORKER_MOVE_SECONDS = 0.1
+
+# Plays a game per seed with the chromosome's weights and returns the total
+# score.
+def run_trials(chromosome, seeds):
+    if policy_name == 'lookahead':
+        policy = LookaheadPolicy(weight_vector(chromosome), placements=True)
+    elif policy_name == 'greedy':
+        policy = GreedyPolicy(weight_vector(chromosome), placements=True)
+    else:
+        return run_worker_trials(chromosome, seeds)
+    simulator = BatchSimulator(policy, clock=CpuClock())
+    return sum(result.score for result in simulator.run(seeds))
+
+# run_trials() for --worker. The C++ AI reads the weights from a temporary
+# file and plays every game in one worker process.
+def run_worker_trials(chromosome, seeds):
     tf = tempfile.NamedTemporaryFile(delete=False)
-
     for key, val in chromosome.iteritems():
         tf.write(key + ' ' + str(val) + '\n')
     tf.close()
 
-    process = subprocess.Popen(['./client.py', 'local', str(seed), tf.name],
-            stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-    stdout, stderr = process.communicate()
-
-    os.unlink(tf.name)
+    policy = WorkerPolicy(tf.name, quiet=True, threads=1)
+    try:
+        simulator = BatchSimulator(policy, clock=FixedClock(WORKER_MOVE_SECONDS))
+        return sum(result.score for result in simulator.run(seeds))
+    finally:
+        policy.stop()
+        os.unlink(tf.name)
 
-    m = re.search('RESULTS: (\d+)', stdout)
+def run_trial(chromosome, seed=random.randint(0, 1024)):
+    # print 'running trial with seed ' + str(seed)
+    return run_trials(chromosome, [seed])
 
-    try:
-        # print 'trial finished with result ' + m.group(1)
-        return int(m.group(1))
-    except:
-        return 0
+# run_trials() for Pool.map().
+def run_chromosome(task):
+    return run_trials(*task)
 
 def randompair(collection):
     random.shuffle(collection)
@@ -78,31 +115,16 @@ class Chromosome(dict):
     def __hash__(self):
         return hash((frozenset(self), frozenset(self.itervalues())))
 
-def run_generation(population):
+# Plays the chromosomes on a pool of processes, one per CPU, one chromosome
+# at a time on each.
+def run_generation(population, pool):
     print 'running generation'
 
     # 4 trials
     seeds = [random.randint(0, 1024) for i in range(4)]
 
-    class RunThread(threading.Thread):
-        def __init__(self, chromosome, seed):
-            threading.Thread.__init__(self)
-            self.chromosome = chromosome;
-            self.seed = seed
-
-        def run(self):
-            self.score = run_trial(self.chromosome, self.seed)
-
-    threads = [RunThread(c, s) for c in population for s in seeds]
-    for thread in threads:
-        thread.start()
-
-    scoremap = dict()
-    for thread in threads:
-        thread.join()
-        if not thread.chromosome in scoremap:
-            scoremap[thread.chromosome] = 0
-        scoremap[thread.chromosome] += thread.score
+    scores = pool.map(run_chromosome, [(c, seeds) for c in population], chunksize=1)
+    scoremap = dict(zip(population, scores))
 
     table = [(c, s) for c, s in scoremap.iteritems()]
 
@@ -140,9 +162,14 @@ def run_generation(population):
         return newpopl, row[1]
 
 if __name__ == '__main__':
+    if '--greedy' in sys.argv[1:]:
+        policy_name = 'greedy'
+    elif '--worker' in sys.argv[1:]:
+        policy_name = 'worker'
+    pool = multiprocessing.Pool()
     population = [generate_random_chromosome() for i in range(16)]
 
     while True:
-        population, topscore = run_generation(population)
+        population, topscore = run_generation(population, pool)
         if topscore / 4 > 100:
             break
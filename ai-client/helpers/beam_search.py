@@ -0,0 +1,175 @@
+import threading
+import time
+
+from logic.Block import COLS
+from logic.Piece import Piece
+from placements import PlacementCache
+from search_board import SearchBoard
+from transposition import TranspositionTable
+
+# Weights of skyline_heuristic(). Points are the game score gained since the
+# root of the search; the rest are read off the skyline of the board.
+DEFAULT_WEIGHTS = {
+  'POINTS': 1.0,
+  'AGGREGATE_HEIGHT': -0.5,
+  'HOLES': -3.5,
+  'BUMPINESS': -0.2,
+}
+
+# A cheap evaluation of a SearchBoard for pruning the beam. It only reads the
+# skyline that the board keeps up to date anyway, so it costs a few additions
+# per column rather than a pass over every square.
+def skyline_heuristic(board, weights=DEFAULT_WEIGHTS):
+  heights = board.heights
+  bumpiness = 0
+  for j in range(COLS - 1):
+    bumpiness += abs(heights[j] - heights[j + 1])
+  return (weights['POINTS']*board.score +
+          weights['AGGREGATE_HEIGHT']*sum(heights) +
+          weights['HOLES']*sum(board.holes) +
+          weights['BUMPINESS']*bumpiness)
+
+# A sequence of placements, one for the current piece and one for each preview
+# piece after it, and the heuristic value of the board at its end.
+class Line(object):
+  __slots__ = ('value', 'placements')
+
+  def __init__(self, value, placements):
+    self.value = value
+    self.placements = placements
+
+  def __repr__(self):
+    return 'Line(%r, %r)' % (self.value, self.placements)
+
+  # The commands that play the first placement of the line.
+  @property
+  def commands(self):
+    return list(self.placements[0].commands) if self.placements else []
+
+# A beam search over the current piece and the preview pieces. Each ply
+# places the next piece in every way enumerate_placements() finds, on each
+# board in the beam, and keeps the `width` best resulting boards according to
+# the heuristic. Placements that lead to the same board are only kept once.
+#
+# The search is anytime: search() takes a deadline, a time.time() value, and
+# returns the best line of the deepest ply it finished before the deadline.
+# The deadline is checked before each board is expanded, so it is overrun by
+# at most one expansion. The first ply has a single board and is always
+# finished, so a move is returned even if the deadline has already passed.
+#
+#   search = BeamSearch(width=8)
+#   line = search.search(state, time.time() + 0.5)
+#   commands = line.commands
+#
+# The placement cache and the table of heuristic values, keyed by the board
+# and its score, are kept between calls, so a BeamSearch should be reused from
+# move to move: boards deeper in one search are often reached again by the
+# next.
+class BeamSearch(object):
+  def __init__(self, width=8, depth=None, heuristic=skyline_heuristic, cache=None,
+               evaluations=None):
+    self.width = width
+    self.depth = depth
+    self.heuristic = heuristic
+    self.cache = cache if cache is not None else PlacementCache()
+    self.evaluations = evaluations if evaluations is not None else TranspositionTable()
+    self.plies = 0
+    self.expanded = 0
+    self.hits = 0
+    self.misses = 0
+    self.values = []
+    self.timed_out = False
+
+  # Searches from a game state in the form of Board.to_dict(). Returns the
+  # best Line found, or None if the current piece cannot be placed at all.
+  def search(self, state, deadline):
+    board = SearchBoard(state['bitmap'])
+    pieces = [Piece.from_dict(state['block'])]
+    pieces.extend(Piece.from_dict(block) for block in state['preview'])
+    return self.search_board(board, pieces, deadline)
+
+  # Searches from a SearchBoard, placing the given Pieces in order. The board
+  # is left at the end of some line in the beam. A deadline of None means
+  # the search only stops once it reaches its depth.
+  def search_board(self, board, pieces, deadline):
+    depth = len(pieces) if self.depth is None else min(self.depth, len(pieces))
+    # Statistics of the search: the number of plies finished, the number of
+    # boards expanded, the number of heuristic values found in and missing
+    # from the table, the best value of each finished ply and whether the
+    # search stopped at the deadline.
+    self.plies = 0
+    self.expanded = 0
+    self.hits = 0
+    self.misses = 0
+    self.values = []
+    self.timed_out = False
+
+    # Each entry of the beam is (value, snapshot of the board, placements).
+    beam = [(0.0, board.snapshot(), ())]
+    best = None
+    for ply in range(depth):
+      candidates = self.expand(board, beam, pieces[ply], deadline if ply else None)
+      if candidates is None:
+        self.timed_out = True
+        break
+      if not candidates:
+        break
+      beam = []
+      for (value, snapshot, line) in candidates:
+        board.restore(snapshot)
+        board.apply_drop(line[-1].piece)
+        beam.append((value, board.snapshot(), line))
+      best = Line(beam[0][0], beam[0][2])
+      self.values.append(best.value)
+      self.plies = ply + 1
+    return best
+
+  # Places the piece in every way on every board of the beam and returns the
+  # `width` best (value, parent snapshot, placements) candidates, best first.
+  # A width of None keeps every candidate.
+  # Returns None if the deadline passed before the ply was finished.
+  def expand(self, board, beam, piece, deadline):
+    heuristic = self.heuristic
+    evaluations = self.evaluations
+    seen = set()
+    candidates = []
+    for (value, snapshot, line) in beam:
+      if deadline is not None and time.time() >= deadline:
+        return None
+      board.restore(snapshot)
+      self.expanded += 1
+      for placement in self.cache.placements(board, piece):
+        token = board.apply_drop(placement.piece)
+        key = (board.key(), board.score)
+        if key not in seen:
+          seen.add(key)
+          value = evaluations.get(key)
+          if value is None:
+            self.misses += 1
+            value = heuristic(board)
+            evaluations.put(key, value)
+          else:
+            self.hits += 1
+          candidates.append((value, snapshot, line + (placement,)))
+        board.undo(token)
+    candidates.sort(key=lambda c: c[0], reverse=True)
+    return candidates[:self.width]
+
+# Seconds that choose_move() spends on each move.
+MOVE_SECONDS = 0.1
+
+# Each thread that plays games gets its own BeamSearch, so that the client
+# can run several games at once (see client.run_practice_games()).
+default_search = threading.local()
+
+# An AI plugin for the client (see client.AIPlugin), for running the beam
+# search without a separate process:
+#
+#   ./client.py local <seed> --plugin=helpers.beam_search:choose_move
+#
+# The deadline is for the whole game, so each move stops after MOVE_SECONDS.
+def choose_move(state, deadline):
+  if not hasattr(default_search, 'search'):
+    default_search.search = BeamSearch()
+  line = default_search.search.search(state, min(deadline.at, time.time() + MOVE_SECONDS))
+  return line.commands if line is not None else []
@@ -0,0 +1,245 @@
+import numpy as np
+
+from logic.Block import (
+  COLS,
+  ROWS,
+)
+from logic.Piece import Piece
+from placements import PlacementCache
+from search_board import SearchBoard
+from transposition import TranspositionTable
+
+# The features tuned by genetic_algo.py and used in weights.txt, in the order
+# of the columns of features() and the entries of a weight vector. They are
+# computed the same way as in ScoreVector::Score, so that weights found for
+# the C++ AI carry over:
+#   LANDING_HEIGHT: See landing_height().
+#   ROWS_CLEARED: The number of rows cleared since the board the search
+#     started from.
+#   POINTS_EARNED: 2**ROWS_CLEARED - 1. Like the C++ AI, this counts the
+#     rows cleared over several placements as if they were cleared at once.
+#   BLOCK_HEIGHT: The sum of the heights above the floor of the filled
+#     squares, counting the bottom row as 1.
+#   ROW_TRANSITIONS: The number of vertically adjacent squares where one is
+#     filled and the other is not.
+#   COL_TRANSITIONS: The number of horizontally adjacent squares where one is
+#     filled and the other is not. Walls do not count.
+#   HOLES: The number of empty squares below the top of their column.
+#   WELL_SUMS: For each column that has an empty square above its top with
+#     both neighbors filled (or a wall), the number of empty squares from
+#     the highest such square down to the floor.
+FEATURES = (
+  'LANDING_HEIGHT',
+  'ROWS_CLEARED',
+  'ROW_TRANSITIONS',
+  'COL_TRANSITIONS',
+  'HOLES',
+  'WELL_SUMS',
+  'POINTS_EARNED',
+  'BLOCK_HEIGHT',
+)
+
+# The score of a placement after which the next piece does not fit at its
+# spawn position, as in the C++ AI.
+MIN_SCORE = -10e6
+
+COLUMN_BITS = 1 << np.arange(COLS)
+ROW_INDICES = np.arange(ROWS)
+
+# Turns a weights dict into a vector in FEATURES order. Missing features get
+# weight zero, and features not in FEATURES are ignored.
+def weight_vector(weights):
+  return np.array([weights.get(feature, 0.0) for feature in FEATURES])
+
+# Reads a weights file with one "NAME value" pair per line, as written by
+# genetic_algo.py and read by the C++ AI.
+def load_weights(fname):
+  weights = {}
+  with open(fname) as f:
+    for line in f:
+      parts = line.split()
+      if len(parts) == 2:
+        weights[parts[0]] = float(parts[1])
+  return weight_vector(weights)
+
+# LANDING_HEIGHT, as the C++ AI computes it. It scores the board after a
+# placement, whose block is already the next one at its spawn position, and
+# takes the column of that block's center plus half the rows it spans. The
+# value is the same for every placement of a move, so it shifts their scores
+# without changing which is best. `block` is a block dict of the game state,
+# normally state['preview'][0]; without one, it is 0.
+def landing_height(block):
+  if block is None:
+    return 0
+  rows = [offset['i'] for offset in block['offsets']]
+  return block['center']['j'] + (max(rows) - min(rows))//2
+
+# Converts an N x ROWS array of row bitmasks into an N x ROWS x COLS array of
+# booleans.
+def unpack_rows(rows):
+  return (np.asarray(rows)[..., np.newaxis] & COLUMN_BITS) != 0
+
+# Computes the features of N candidate boards at once. `boards` is either an
+# N x ROWS x COLS array of squares (nonzero meaning filled) or an N x ROWS
+# array of row bitmasks. rows_cleared has one entry per board, and
+# landing_heights one per board or one for all of them. Returns an N x len(FEATURES) float array.
+def features(boards, landing_heights, rows_cleared):
+  boards = np.asarray(boards)
+  if boards.ndim == 2:
+    filled = unpack_rows(boards)
+  else:
+    filled = boards != 0
+  n = filled.shape[0]
+
+  # The top of each column: the row of its highest filled square, or ROWS.
+  has_square = filled.any(axis=1)
+  tops = np.where(has_square, filled.argmax(axis=1), ROWS)
+  column_squares = filled.sum(axis=1)
+  holes = (ROWS - tops - column_squares).sum(axis=1)
+
+  row_transitions = (filled[:, 1:, :] != filled[:, :-1, :]).sum(axis=(1, 2))
+  col_transitions = (filled[:, :, 1:] != filled[:, :, :-1]).sum(axis=(1, 2))
+
+  walls = np.ones((n, ROWS, 1), dtype=bool)
+  left = np.concatenate((walls, filled[:, :, :-1]), axis=2)
+  right = np.concatenate((filled[:, :, 1:], walls), axis=2)
+  above_top = ROW_INDICES[np.newaxis, :, np.newaxis] < tops[:, np.newaxis, :]
+  wells = above_top & left & right
+  has_well = wells.any(axis=1)
+  well_tops = wells.argmax(axis=1)
+  well_sums = np.where(has_well, ROWS - well_tops - column_squares, 0).sum(axis=1)
+
+  rows_cleared = np.asarray(rows_cleared, dtype=float)
+  block_height = (filled.sum(axis=2)*(ROWS - ROW_INDICES)).sum(axis=1)
+
+  return np.column_stack((
+    np.broadcast_to(np.asarray(landing_heights, dtype=float), (n,)),
+    rows_cleared,
+    row_transitions,
+    col_transitions,
+    holes,
+    well_sums,
+    2**rows_cleared - 1,
+    block_height,
+  )).astype(float)
+
+# Scores N candidate boards against a weight vector (see weight_vector()).
+# Returns an array of N scores; higher is better.
+def score(boards, landing_heights, rows_cleared, weights):
+  return features(boards, landing_heights, rows_cleared).dot(weights)
+
+# Scores every placement (see placements.enumerate_placements()) of a piece on
+# a SearchBoard. Each placement is dropped and undone in turn to collect the
+# resulting rows, and all of them are then scored in one batch. The landing
+# height is that of the move (see landing_height()), and `cleared` the rows
+# already cleared since the board the search started from. If the next piece
+# is given, placements after which it does not fit score MIN_SCORE.
+#
+# If a TranspositionTable is given, scores are looked up in it by the board
+# after the placement, the landing height and the rows cleared, and only the
+# placements not found there are scored. The table must only hold scores for
+# the same weights.
+def score_placements(board, placements, weights, landing_height=0, cleared=0,
+                     next_piece=None, evaluations=None):
+  scores = np.empty(len(placements))
+  missed = []
+  keys = []
+  rows = np.empty((len(placements), ROWS), dtype=np.uint16)
+  rows_cleared = np.empty(len(placements))
+  for (k, placement) in enumerate(placements):
+    token = board.apply_drop(placement.piece)
+    if next_piece is not None and not board.check(next_piece):
+      scores[k] = MIN_SCORE
+      board.undo(token)
+      continue
+    if evaluations is not None:
+      key = (board.key(), landing_height, cleared + token.num_rows_cleared)
+      value = evaluations.get(key)
+      if value is not None:
+        scores[k] = value
+        board.undo(token)
+        continue
+      keys.append(key)
+    n = len(missed)
+    missed.append(k)
+    rows[n] = board.rows
+    rows_cleared[n] = cleared + token.num_rows_cleared
+    board.undo(token)
+  if missed:
+    n = len(missed)
+    scores[missed] = score(rows[:n], landing_height, rows_cleared[:n], weights)
+    for (key, k) in zip(keys, missed):
+      evaluations.put(key, scores[k])
+  return scores
+
+# An AI that plays the placement of the current piece that scores best
+# against a weight vector, looking at the preview only to see whether the
+# next piece still fits. It is called like a client plugin (see
+# client.AIPlugin), so it can be run by the client or by
+# batch.BatchSimulator:
+#
+#   policy = GreedyPolicy(load_weights('weights.txt'))
+#   commands = policy(state, deadline)
+#
+# With placements set, it returns the Placement instead of its commands, for
+# BatchSimulator to play in one step. The client only takes commands.
+#
+# Scores are kept in a TranspositionTable for the life of the policy; its
+# hits and misses count how many placements were scored from it and how
+# many had to be computed.
+class GreedyPolicy(object):
+  def __init__(self, weights, cache=None, placements=False, evaluations=None):
+    self.weights = weights
+    self.cache = cache if cache is not None else PlacementCache()
+    self.placements = placements
+    self.evaluations = evaluations if evaluations is not None else TranspositionTable()
+
+  def __call__(self, state, deadline):
+    board = SearchBoard(state['bitmap'])
+    pieces = [Piece.from_dict(state['block'])]
+    pieces.extend(Piece.from_dict(block) for block in state['preview'])
+    placements = self.cache.placements(board, pieces[0])
+    if not placements:
+      return []
+    preview = state['preview'][0] if state['preview'] else None
+    scores = self.score(board, placements, pieces, landing_height(preview))
+    best = placements[int(scores.argmax())]
+    return best if self.placements else list(best.commands)
+
+  # The scores of the placements of pieces[0].
+  def score(self, board, placements, pieces, landing_height):
+    return self.score_ply(board, placements, pieces, landing_height, 0)
+
+  # Scores the placements of pieces[0] on a board reached after clearing
+  # `cleared` rows.
+  def score_ply(self, board, placements, pieces, landing_height, cleared):
+    next_piece = pieces[1] if len(pieces) > 1 else None
+    return score_placements(board, placements, self.weights, landing_height, cleared,
+                            next_piece, self.evaluations)
+
+# The search of the C++ AI's FindBestMove, in this process. Each placement of
+# the current piece that scores above the average of them is followed by
+# every placement of the first preview piece, and each of those that scores
+# above their average by every placement of the second. A placement scores
+# the best of its own score and those of the third-level placements below it.
+class LookaheadPolicy(GreedyPolicy):
+  def score(self, board, placements, pieces, landing_height):
+    scores = self.score_ply(board, placements, pieces, landing_height, 0)
+    if len(pieces) < 3:
+      return scores
+    for k in np.flatnonzero(scores > scores.mean()):
+      token = board.apply_drop(placements[k].piece)
+      placements2 = self.cache.placements(board, pieces[1])
+      if placements2:
+        scores2 = self.score_ply(board, placements2, pieces[1:], landing_height,
+                                 token.num_rows_cleared)
+        for k2 in np.flatnonzero(scores2 > scores2.mean()):
+          token2 = board.apply_drop(placements2[k2].piece)
+          placements3 = self.cache.placements(board, pieces[2])
+          if placements3:
+            scores3 = self.score_ply(board, placements3, pieces[2:], landing_height,
+                                     token.num_rows_cleared + token2.num_rows_cleared)
+            scores[k] = max(scores[k], scores3.max())
+          board.undo(token2)
+      board.undo(token)
+    return scores
@@ -1,5 +1,10 @@
 from copy import deepcopy
 
+from logic.Bitboard import Bitboard, rows_from_bitmap
+from logic.Block import orientation_index, orientations
+from logic.Piece import Piece
+import placements
+
 COLS = 12
 ROWS = 33
 
@@ -28,15 +33,39 @@ class Helper(object):
   # The block's original position is assumed to be valid.
   @staticmethod
   def rotate(bitmap, block):
-    result = dict(block)
-    result['offsets'] = [{
-      'i': offset['j'],
-      'j': -offset['i'],
-    } for offset in result['offsets']]
+    table = orientations(block['type'])
+    result = Helper.orient(block, table[orientation_index(block)].next)
     if not Helper.check(bitmap, result):
       raise InvalidMoveError()
     return result
 
+  # Returns a copy of the block turned to orientations(type)[index], keeping
+  # its center. The result is not checked against any bitmap.
+  @staticmethod
+  def orient(block, index):
+    result = dict(block)
+    result['offsets'] = [{'i': i, 'j': j}
+                         for (i, j) in orientations(block['type'])[index].offsets]
+    return result
+
+  # Returns a list of (rotations, block) pairs, one for each distinct shape
+  # the block can be turned into, where rotations is the smallest number of
+  # rotate commands that reach that shape. Orientations that are translations
+  # of an earlier one are skipped, so symmetric blocks yield fewer than four
+  # entries.
+  @staticmethod
+  def distinct_orientations(block):
+    table = orientations(block['type'])
+    index = orientation_index(block)
+    shapes = set()
+    result = []
+    for rotations in range(len(table)):
+      if table[index].shape not in shapes:
+        shapes.add(table[index].shape)
+        result.append((rotations, Helper.orient(block, index)))
+      index = table[index].next
+    return result
+
   @staticmethod
   def translate(bitmap, block, i=0, j=0):
     result = dict(block)
@@ -75,7 +104,8 @@ class Helper(object):
     return temp_block['center']['i'] - block['center']['i'] - 1
 
   # Takes a bitmap and a block. Drops that block as far as possible, then
-  # removes any rows that are now full. Returns a dict:
+  # removes any rows that are now full. Only the rows the block landed in can
+  # become full, so only those are tested. Returns a dict:
   # {
   #   'bitmap': The new bitmap after the drop.
   #   'num_rows_cleared': The number of rows cleared by the drop.
@@ -88,11 +118,32 @@ class Helper(object):
     rows_free = Helper.rows_free(bitmap, block)
     if rows_free < 0:
       raise InvalidMoveError()
+    rows = set()
     for point in block['offsets']:
       i = point['i'] + block['center']['i'] + rows_free
       j = point['j'] + block['center']['j']
       new_bitmap[i][j] = block['type'] + 1
-    return Helper.remove_rows(new_bitmap)
+      rows.add(i)
+    num_rows_cleared = Helper.clear_rows(new_bitmap, sorted(rows))
+    return {
+      'bitmap': new_bitmap,
+      'num_rows_cleared': num_rows_cleared,
+      'delta_score': 2**num_rows_cleared - 1,
+    }
+
+  # Takes a bitmap and a sorted list of row indices, and removes the full rows
+  # among them in place. The cleared row lists are emptied and moved to the
+  # top of the bitmap. Returns the number of rows cleared.
+  @staticmethod
+  def clear_rows(bitmap, rows):
+    num_rows_cleared = 0
+    for i in rows:
+      if all(bitmap[i]):
+        row = bitmap.pop(i)
+        row[:] = [0]*COLS
+        bitmap.insert(0, row)
+        num_rows_cleared += 1
+    return num_rows_cleared
 
   # Takes a bitmap and removes any full rows. Returns the same data as drop().
   @staticmethod
@@ -105,3 +156,32 @@ class Helper(object):
       'num_rows_cleared': num_rows_cleared,
       'delta_score': 2**num_rows_cleared - 1,
     }
+
+  # Takes a bitmap and a block, and finds every distinct position the block
+  # can come to rest in. Returns a list with one dict per position:
+  # {
+  #   'commands': A shortest list of commands that moves the block there.
+  #   'block': The block in its resting position.
+  #   'bitmap', 'num_rows_cleared', 'delta_score': The result of dropping it,
+  #     as returned by drop().
+  # }
+  # If the block's position is invalid, returns an empty list.
+  @staticmethod
+  def enumerate_placements(bitmap, block):
+    board = Bitboard(rows_from_bitmap(bitmap))
+    result = []
+    for placement in placements.enumerate_placements(board, Piece.from_dict(block)):
+      new_bitmap = [row[:] for row in bitmap]
+      rows = set()
+      for (i, j) in placement.piece.cells():
+        new_bitmap[i][j] = block['type'] + 1
+        rows.add(i)
+      num_rows_cleared = Helper.clear_rows(new_bitmap, sorted(rows))
+      result.append({
+        'commands': list(placement.commands),
+        'block': placement.piece.to_dict(),
+        'bitmap': new_bitmap,
+        'num_rows_cleared': num_rows_cleared,
+        'delta_score': 2**num_rows_cleared - 1,
+      })
+    return result
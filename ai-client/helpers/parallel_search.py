@@ -0,0 +1,154 @@
+import multiprocessing
+import threading
+import time
+
+from beam_search import (
+  BeamSearch,
+  MOVE_SECONDS,
+  skyline_heuristic,
+)
+from search_board import SearchBoard
+
+# Seconds the workers set aside for sending their candidates back.
+RESULT_MARGIN = 0.02
+
+# The BeamSearch of a worker process. It is created once, when the pool
+# starts, so that its placement cache and table of heuristic values last from
+# turn to turn.
+worker_search = None
+
+def init_worker(width, heuristic):
+  global worker_search
+  worker_search = BeamSearch(width=width, heuristic=heuristic)
+
+# Runs in a worker process. `snapshots` are consecutive boards of the beam,
+# as SearchBoard.snapshot() tuples, and `start` is the index in the beam of
+# the first of them. Places the piece in every way on each board, as
+# BeamSearch.expand() does, and returns the best (value, beam index,
+# placement) candidates, best first, or None if the deadline passed first.
+# The worker's numbers of boards expanded and of heuristic values found in
+# and missing from its table come back with them.
+def expand_boards(task):
+  (snapshots, start, piece, deadline) = task
+  search = worker_search
+  search.expanded = 0
+  search.hits = 0
+  search.misses = 0
+  board = SearchBoard.from_rows(snapshots[0][0])
+  beam = [(0.0, snapshot, (start + k,)) for (k, snapshot) in enumerate(snapshots)]
+  candidates = search.expand(board, beam, piece, deadline)
+  if candidates is not None:
+    candidates = [(value, line[0], line[1]) for (value, snapshot, line) in candidates]
+  return (candidates, search.expanded, search.hits, search.misses)
+
+# Experimental: a BeamSearch that splits the boards of each ply across a pool
+# of worker processes. The beam is cut into one run of consecutive boards per worker,
+# each worker expands its boards and sends back its `width` best candidates,
+# and the parent merges them into the beam of the next ply. Only the board
+# snapshots, the piece and the winning placements cross between processes.
+#
+# A candidate that makes the global cut also makes the cut of its worker, and
+# the runs come back in beam order, so the merged beam is the one BeamSearch
+# would keep: both searches return the same line. A search is only faster
+# once a ply has enough boards to keep the workers busy for longer than a
+# round trip to the pool, so the first ply, which has a single board, runs
+# on one worker.
+#
+# The pool is started once, by the constructor, and reused for every
+# search() until close() is called:
+#
+#   search = ParallelSearch(width=8)
+#   line = search.search(state, time.time() + 0.5)
+#   commands = line.commands
+#   ...
+#   search.close()
+#
+# The statistics of a search are those of BeamSearch, summed over the
+# workers.
+#
+# It has not been shown to be faster than BeamSearch: bench_search.py only
+# measures the cost of the round trips on a single CPU, where it is slower.
+# BeamSearch stays the search of every AI until bench_search.py shows a
+# speedup on a machine with several cores.
+#
+# When a ply times out, the workers may still be finishing their boards. The
+# next ply waits for them, within its own deadline, before it hands out more
+# work, so that its tasks do not queue up behind the stale ones.
+class ParallelSearch(BeamSearch):
+  def __init__(self, processes=None, width=8, depth=None, heuristic=skyline_heuristic):
+    BeamSearch.__init__(self, width=width, depth=depth, heuristic=heuristic)
+    self.processes = processes or multiprocessing.cpu_count()
+    self.pool = multiprocessing.Pool(
+        self.processes, initializer=init_worker, initargs=(width, heuristic))
+    self.pending = None
+
+  def close(self):
+    self.pool.terminate()
+    self.pool.join()
+
+  def expand(self, board, beam, piece, deadline):
+    if self.pending is not None:
+      self.pending.wait(None if deadline is None else max(deadline - time.time(), 0))
+      if not self.pending.ready():
+        return None
+      self.pending = None
+
+    n = min(self.processes, len(beam))
+    bounds = [len(beam)*k//n for k in range(n + 1)]
+    margin = None if deadline is None else deadline - RESULT_MARGIN
+    tasks = [([snapshot for (value, snapshot, line) in beam[bounds[k]:bounds[k + 1]]],
+              bounds[k], piece, margin) for k in range(n)]
+    result = self.pool.map_async(expand_boards, tasks, chunksize=1)
+    try:
+      results = result.get(None if deadline is None else max(deadline - time.time(), 0))
+    except multiprocessing.TimeoutError:
+      self.pending = result
+      return None
+
+    candidates = []
+    timed_out = False
+    for (chunk, expanded, hits, misses) in results:
+      self.expanded += expanded
+      self.hits += hits
+      self.misses += misses
+      if chunk is None:
+        timed_out = True
+      else:
+        candidates.extend(chunk)
+    if timed_out:
+      return None
+
+    # Placements that lead to the same board have the same value, so after a
+    # stable sort the first of them is also the first in beam order, which is
+    # the one BeamSearch keeps.
+    candidates.sort(key=lambda c: c[0], reverse=True)
+    seen = set()
+    merged = []
+    for (value, index, placement) in candidates:
+      if self.width is not None and len(merged) == self.width:
+        break
+      (parent_value, snapshot, line) = beam[index]
+      board.restore(snapshot)
+      board.apply_drop(placement.piece)
+      key = (board.key(), board.score)
+      if key not in seen:
+        seen.add(key)
+        merged.append((value, snapshot, line + (placement,)))
+    return merged
+
+# Each thread that plays games gets its own ParallelSearch, as with
+# beam_search.choose_move().
+default_search = threading.local()
+
+# An AI plugin for the client (see client.AIPlugin) that runs the beam search
+# on a worker process per CPU. Like ParallelSearch, it is experimental; use
+# beam_search.choose_move() to play:
+#
+#   ./client.py local <seed> --plugin=helpers.parallel_search:choose_move
+#
+# The deadline is for the whole game, so each move stops after MOVE_SECONDS.
+def choose_move(state, deadline):
+  if not hasattr(default_search, 'search'):
+    default_search.search = ParallelSearch()
+  line = default_search.search.search(state, min(deadline.at, time.time() + MOVE_SECONDS))
+  return line.commands if line is not None else []
@@ -0,0 +1,210 @@
+from logic.Bitboard import (
+  Bitboard,
+  FULL_ROW,
+)
+from logic.Block import (
+  COLS,
+  ROWS,
+  orientations,
+)
+from logic.Piece import Piece
+from transposition import TranspositionTable
+
+# A resting position of a piece, and the shortest tuple of commands that moves
+# the piece there before it is dropped.
+class Placement(object):
+  __slots__ = ('piece', 'commands')
+
+  def __init__(self, piece, commands):
+    self.piece = piece
+    self.commands = commands
+
+  def __repr__(self):
+    return 'Placement(%r, %r)' % (self.piece, self.commands)
+
+  def __reduce__(self):
+    return (Placement, (self.piece, self.commands))
+
+# Returns a Placement for every distinct resting position the piece can reach
+# on the given Bitboard with the left, right, up, down and rotate commands.
+# Positions that cover the same squares are only returned once, with the
+# shortest command list that reaches any of them. Returns an empty list if
+# the piece's own position is invalid.
+#
+# This is a breadth-first search over (i, j, orientation) positions. Moves are
+# tested directly against the row bitmasks, so blocked moves cost a failed
+# mask test rather than an exception.
+def enumerate_placements(board, piece):
+  table = orientations(piece.type)
+  rows = board.rows
+  if not board.fits(table[piece.orientation], piece.i, piece.j):
+    return []
+
+  # For each orientation, (min_i, min_j, max top row, max left column, masks).
+  shapes = [(o.min_i, o.min_j, ROWS - o.height, COLS - o.width, o.masks)
+            for o in table]
+
+  def fits(i, j, o):
+    (min_i, min_j, max_top, max_left, masks) = shapes[o]
+    top = i + min_i
+    left = j + min_j
+    if top < 0 or top > max_top or left < 0 or left > max_left:
+      return False
+    for mask in masks:
+      if rows[top] & (mask << left):
+        return False
+      top += 1
+    return True
+
+  start = (piece.i, piece.j, piece.orientation)
+  parents = {start: None}
+  queue = [start]
+  # Where each orientation lands in each column when dropped from above the
+  # skyline, computed on first use.
+  landings = {}
+  resting = set()
+  found = []
+  for pose in queue:
+    (i, j, o) = pose
+    orientation = table[o]
+    landing = landings.get((j, o))
+    if landing is None:
+      landing = landings[(j, o)] = board.landing(orientation, j)
+    if i > landing:
+      landing = i + board.slide(Piece(piece.type, o, i, j))
+    key = (orientation.shape, landing + orientation.min_i, j + orientation.min_j)
+    if key not in resting:
+      resting.add(key)
+      found.append((pose, landing))
+
+    # The moves are unrolled; this loop is the hot path of every search.
+    next = (i, j - 1, o)
+    if next not in parents and fits(i, j - 1, o):
+      parents[next] = (pose, 'left')
+      queue.append(next)
+    next = (i, j + 1, o)
+    if next not in parents and fits(i, j + 1, o):
+      parents[next] = (pose, 'right')
+      queue.append(next)
+    next = (i + 1, j, o)
+    if next not in parents and fits(i + 1, j, o):
+      parents[next] = (pose, 'down')
+      queue.append(next)
+    next = (i - 1, j, o)
+    if next not in parents and fits(i - 1, j, o):
+      parents[next] = (pose, 'up')
+      queue.append(next)
+    next = (i, j, orientation.next)
+    if next not in parents and fits(i, j, orientation.next):
+      parents[next] = (pose, 'rotate')
+      queue.append(next)
+
+  placements = []
+  for (pose, landing) in found:
+    commands = []
+    step = parents[pose]
+    while step is not None:
+      commands.append(step[1])
+      step = parents[step[0]]
+    commands.reverse()
+    placements.append(
+        Placement(Piece(piece.type, pose[2], landing, pose[1]), tuple(commands)))
+  return placements
+
+# Returns the board's rows with every hole the piece can never enter filled
+# in. Squares above the skyline are empty, so what a placement search sees is
+# the skyline plus the holes it can get into. Pieces are connected, so a
+# valid position lies inside one connected region of empty squares. A region
+# of holes that is sealed off from the squares above the skyline and smaller
+# than the piece can never hold it, and filling it in changes no search
+# result. If the sealed holes add up to at least the piece's size, they are
+# kept as they are.
+def surface(board, piece):
+  rows = board.rows
+  if not any(board.holes):
+    return tuple(rows)
+  tops = board.heights
+  # Empty squares reachable from above the skyline, grown one step at a time
+  # through the holes.
+  above = [sum(1 << j for j in range(COLS) if ROWS - tops[j] > i)
+           for i in range(ROWS)]
+  reached = above[:]
+  empty = [FULL_ROW & ~row for row in rows]
+  changed = True
+  while changed:
+    changed = False
+    for i in range(ROWS):
+      grown = reached[i] | (reached[i] << 1) | (reached[i] >> 1)
+      if i > 0:
+        grown |= reached[i - 1]
+      if i < ROWS - 1:
+        grown |= reached[i + 1]
+      grown &= empty[i]
+      if grown != reached[i]:
+        reached[i] = grown
+        changed = True
+  sealed = [empty[i] & ~reached[i] for i in range(ROWS)]
+  size = len(orientations(piece.type)[0].offsets)
+  if sum(bin(row).count('1') for row in sealed) >= size:
+    return tuple(rows)
+  return tuple(rows[i] | sealed[i] for i in range(ROWS))
+
+# Returns the lowest row the piece's search needs to see on a board without
+# holes. A resting position there is a column dropped straight down into, so
+# any position can be reached by moves that keep the center at or above the
+# piece's spawn row, or at or above the row where every orientation clears
+# the ceiling, whichever is lower. A path that goes deeper can be raised to
+# that row without getting longer.
+def reach(piece):
+  table = orientations(piece.type)
+  lift = max(-o.min_i for o in table)
+  depth = max(o.min_i + o.height - 1 for o in table)
+  return min(max(piece.i, lift) + depth, ROWS - 1)
+
+# True if every occupied square of the rows has an occupied square or the
+# floor below it, so that the board is its skyline.
+def solid(rows):
+  for i in range(ROWS - 1):
+    if rows[i] & ~rows[i + 1]:
+      return False
+  return True
+
+# A bounded cache of enumerate_placements() results.
+#
+# On a board that is its skyline, once holes no piece can reach are filled
+# in (see surface()), the commands of a placement only depend on the rows the
+# piece moves through, down to reach(piece), and the placement itself is a
+# column dropped into. Such boards are keyed by the piece and the column
+# heights within its reach, measured from the bottom of the reach, so all
+# boards whose stack stays below the reach share one entry. The entry holds
+# the orientation, column and commands of each placement, found on the board
+# with everything below the reach filled in, and the landing rows are read
+# off the board's own skyline on every lookup.
+#
+# A board with holes a piece can get into is searched in full, keyed by its
+# surface(), since sliding under an overhang can reach any depth.
+class PlacementCache(TranspositionTable):
+  def placements(self, board, piece):
+    rows = board.rows
+    if any(board.holes):
+      rows = surface(board, piece)
+      if not solid(rows):
+        key = (piece, rows)
+        placements = self.get(key)
+        if placements is None:
+          placements = enumerate_placements(board, piece)
+          self.put(key, placements)
+        return placements
+
+    bottom = reach(piece)
+    floor = ROWS - 1 - bottom
+    key = (piece, tuple(max(height - floor, 0) for height in board.heights))
+    routes = self.get(key)
+    if routes is None:
+      clipped = Bitboard(list(rows[:bottom + 1]) + [FULL_ROW]*(ROWS - 1 - bottom))
+      table = orientations(piece.type)
+      routes = [(table[p.piece.orientation], p.piece.orientation, p.piece.j, p.commands)
+                for p in enumerate_placements(clipped, piece)]
+      self.put(key, routes)
+    return [Placement(Piece(piece.type, o, board.landing(orientation, j), j), commands)
+            for (orientation, o, j, commands) in routes]
@@ -0,0 +1,97 @@
+from helper import InvalidMoveError
+from logic.Bitboard import (
+  Bitboard,
+  FULL_ROW,
+  rows_from_bitmap,
+)
+from logic.Block import COLS
+
+# Everything undo() needs to take back one apply_drop(): the dropped piece and
+# how far it fell, the rows it cleared, and the skyline, hash and score before
+# it.
+class UndoToken(object):
+  __slots__ = ('piece', 'rows_free', 'cleared', 'tops', 'holes', 'hash', 'score')
+
+  def __init__(self, piece, rows_free, cleared, tops, holes, hash, score):
+    self.piece = piece
+    self.rows_free = rows_free
+    self.cleared = cleared
+    self.tops = tops
+    self.holes = holes
+    self.hash = hash
+    self.score = score
+
+  @property
+  def num_rows_cleared(self):
+    return len(self.cleared)
+
+# A mutable board for searching over placements. Instead of copying the
+# bitmap for every candidate, a search applies a drop, evaluates the board and
+# undoes the drop again:
+#
+#   board = SearchBoard(state['bitmap'])
+#   token = board.apply_drop(Piece.from_dict(block))
+#   ...
+#   board.undo(token)
+#
+# Tokens must be undone in the reverse order they were applied.
+class SearchBoard(Bitboard):
+  def __init__(self, bitmap, score=0):
+    Bitboard.__init__(self, rows_from_bitmap(bitmap))
+    self.score = score
+
+  # Builds a SearchBoard from a sequence of row bitmasks, the compact form
+  # used to send boards between processes.
+  @staticmethod
+  def from_rows(rows, score=0):
+    board = SearchBoard.__new__(SearchBoard)
+    Bitboard.__init__(board, rows)
+    board.score = score
+    return board
+
+  # Drops the piece as far as possible from its current position and removes
+  # the rows that are now full. Returns a token for undo(). If the piece's
+  # position is invalid, throws an InvalidMoveError.
+  def apply_drop(self, piece):
+    rows_free = self.rows_free(piece)
+    if rows_free < 0:
+      raise InvalidMoveError()
+    tops = self._tops[:]
+    holes = self._holes[:]
+    hash = self.hash
+    score = self.score
+    top = self.land(piece, rows_free)
+    cleared = self.clear_rows(range(top, top + piece.geometry.height))
+    self.score += 2**len(cleared) - 1
+    return UndoToken(piece, rows_free, cleared, tops, holes, hash, score)
+
+  def undo(self, token):
+    rows = self.rows
+    for i in reversed(token.cleared):
+      del rows[0]
+      rows.insert(i, FULL_ROW)
+    orientation = token.piece.geometry
+    top = token.piece.i + orientation.min_i + token.rows_free
+    left = token.piece.j + orientation.min_j
+    for (k, mask) in enumerate(orientation.masks):
+      rows[top + k] &= ~(mask << left)
+    self._tops[:] = token.tops
+    self._holes[:] = token.holes
+    self.hash = token.hash
+    self.score = token.score
+
+  # Returns the board's rows, skyline, hash and score as a tuple, for
+  # restore() to return to later. Unlike undo tokens, snapshots can be
+  # restored in any order.
+  def snapshot(self):
+    return (tuple(self.rows), tuple(self._tops), tuple(self._holes),
+            self.hash, self.score)
+
+  def restore(self, snapshot):
+    (rows, tops, holes, self.hash, self.score) = snapshot
+    self.rows[:] = rows
+    self._tops[:] = tops
+    self._holes[:] = holes
+
+  def to_bitmap(self):
+    return [[(row >> j) & 1 for j in range(COLS)] for row in self.rows]
@@ -0,0 +1,66 @@
+# A bounded cache of board evaluations, keyed by Bitboard.key(). Different
+# command orders and different preview orders often reach the same board, and
+# a search can look the board up here before scoring it again.
+#
+# Each entry remembers the search depth it was computed at, and get() only
+# returns entries computed at least as deep as requested.
+#
+# The table is looked up once per candidate board, often in place of an
+# evaluation that is only a few additions, so it is kept to plain dicts: new
+# entries go into a young generation, and once that holds half of `capacity`
+# entries it becomes the old generation, dropping the previous old one. An
+# entry found in the old generation moves back to the young one, so the
+# entries dropped are about the least recently used.
+class TranspositionTable(object):
+  def __init__(self, capacity=1 << 16):
+    self.capacity = capacity
+    self.entries = {}
+    self.old_entries = {}
+    self.hits = 0
+    self.misses = 0
+
+  def __len__(self):
+    return len(self.entries) + len(self.old_entries)
+
+  def __contains__(self, key):
+    return key in self.entries or key in self.old_entries
+
+  # Returns the value stored for the key, or None if there is no entry
+  # computed at the given depth or deeper.
+  def get(self, key, depth=0):
+    entry = self.entries.get(key)
+    if entry is None:
+      entry = self.old_entries.pop(key, None)
+      if entry is not None:
+        self.store(key, entry)
+    if entry is None or entry[1] < depth:
+      self.misses += 1
+      return None
+    self.hits += 1
+    return entry[0]
+
+  def put(self, key, value, depth=0):
+    entry = self.entries.get(key) or self.old_entries.pop(key, None)
+    if entry is not None and entry[1] > depth:
+      # Keep the deeper result.
+      value = entry[0]
+      depth = entry[1]
+    self.store(key, (value, depth))
+
+  def store(self, key, entry):
+    entries = self.entries
+    if len(entries) >= (self.capacity + 1)//2 and key not in entries:
+      self.old_entries = entries
+      self.entries = entries = {}
+    entries[key] = entry
+
+  def clear(self):
+    self.entries.clear()
+    self.old_entries.clear()
+    self.hits = 0
+    self.misses = 0
+
+  @property
+  def hit_rate(self):
+    lookups = self.hits + self.misses
+    return float(self.hits)/lookups if lookups else 0.0
@@ -0,0 +1,276 @@
+import random
+
+import numpy as np
+
+import evaluator
+from logic.Bitboard import FULL_ROW
+from logic.Piece import Piece
+from logic.Block import (
+  COLS,
+  ROWS,
+  MAX_BLOCK_SIZE,
+  centers,
+  orientations,
+  types,
+)
+from logic.Board import (
+  PREVIEW,
+  level_thresholds,
+)
+
+# Placements are indexed by pose: the orientation index o and the column j of
+# the piece's center, as o*COLS + j. A pose exists if the piece fits inside
+# the board at its spawn row in that orientation and column.
+POSES = 4*COLS
+
+# Random numbers are drawn for all boards in chunks of this many blocks.
+CHUNK = 256
+
+# A NumPy generator in the same state as random.Random(seed), so that it
+# draws the same numbers as a Board with that seed. Both are the Mersenne
+# Twister, and random_sample() builds its doubles the same way as random().
+def seeded_generator(seed):
+  (version, state, gauss) = random.Random(seed).getstate()
+  generator = np.random.RandomState()
+  generator.set_state(('MT19937', np.array(state[:-1], dtype=np.uint32), state[-1]))
+  return generator
+
+# The placement table of a block type, for every pose:
+#   cell_rows, cell_cols: its cells at the spawn row, padded to MAX_BLOCK_SIZE
+#     by repeating the first cell.
+#   masks, top: its row bitmasks, padded to MAX_BLOCK_SIZE with zeros, and
+#     the board row of the first of them at the spawn row.
+#   placement: whether the pose is a placement. Only canonical orientations
+#     are, and only if every pose on the way there exists.
+#   path: the poses a placement passes through. It is played by rotating at
+#     the spawn position and then moving left or right, so these are the
+#     orientations up to its own in the spawn column, then the columns up to
+#     its own in its orientation.
+#   landing_height: evaluator.landing_height() of a block of this type, for
+#     the moves where it is the next block.
+class PlacementTable(object):
+  def __init__(self, type):
+    table = orientations(type)
+    (i0, j0) = (centers[2*type], centers[2*type + 1])
+    self.center = i0
+    self.landing_height = evaluator.landing_height(Piece.spawn(type).to_dict())
+    self.cell_rows = np.zeros((POSES, MAX_BLOCK_SIZE), dtype=np.intp)
+    self.cell_cols = np.zeros((POSES, MAX_BLOCK_SIZE), dtype=np.intp)
+    self.masks = np.zeros((POSES, MAX_BLOCK_SIZE), dtype=np.uint16)
+    self.top = np.zeros(POSES, dtype=np.intp)
+    self.placement = np.zeros(POSES, dtype=bool)
+    self.path = np.zeros((POSES, POSES), dtype=bool)
+
+    exists = np.zeros(POSES, dtype=bool)
+    for (o, orientation) in enumerate(table):
+      top = i0 + orientation.min_i
+      if top < 0 or top + orientation.height > ROWS:
+        continue
+      for j in range(COLS):
+        left = j + orientation.min_j
+        if left < 0 or left + orientation.width > COLS:
+          continue
+        pose = o*COLS + j
+        exists[pose] = True
+        cells = [(i0 + i, j + jj) for (i, jj) in orientation.offsets]
+        cells += cells[:1]*(MAX_BLOCK_SIZE - len(cells))
+        self.cell_rows[pose] = [i for (i, jj) in cells]
+        self.cell_cols[pose] = [jj for (i, jj) in cells]
+        self.masks[pose, :orientation.height] = [mask << left for mask in orientation.masks]
+        self.top[pose] = top
+
+    for (o, orientation) in enumerate(table):
+      if orientation.shape != o:
+        continue
+      for j in range(COLS):
+        pose = o*COLS + j
+        path = [k*COLS + j0 for k in range(o + 1)]
+        path += [o*COLS + jj for jj in range(min(j, j0), max(j, j0) + 1)]
+        if all(exists[p] for p in path):
+          self.placement[pose] = True
+          self.path[pose, path] = True
+
+# The commands that play the placement with the given pose index.
+def commands(type, pose):
+  (o, j) = divmod(pose, COLS)
+  shift = j - centers[2*type + 1]
+  return ['rotate']*o + ['left' if shift < 0 else 'right']*abs(shift)
+
+# The placement tables of all block types seen so far, stacked into arrays
+# that are indexed by a slot per type. Types are added as they are drawn.
+class PlacementTables(object):
+  def __init__(self):
+    self.slots = np.full(types[-1], -1, dtype=np.intp)
+    self.tables = []
+
+  def lookup(self, block_types):
+    new = [t for t in np.unique(block_types) if self.slots[t] < 0]
+    if new:
+      for t in new:
+        self.slots[t] = len(self.tables)
+        self.tables.append(PlacementTable(t))
+      for name in ('center', 'cell_rows', 'cell_cols', 'masks', 'top', 'placement', 'path',
+                   'landing_height'):
+        setattr(self, name, np.array([getattr(table, name) for table in self.tables]))
+    return self.slots[block_types]
+
+# Every placement of the current block on each live board, computed at once:
+#   boards: the indices of the live boards.
+#   valid: a boards x POSES array, true for the poses that are placements
+#     and whose whole path is free.
+#   rows: the row bitmasks after each placement and the rows it clears.
+#   landing_heights, rows_cleared: as for evaluator.features().
+#   next_fits: whether the next block fits at its spawn position after the
+#     placement.
+# Entries for invalid placements hold garbage.
+class Expansion(object):
+  def __init__(self, boards, valid, rows, landing_heights, rows_cleared, next_fits):
+    self.boards = boards
+    self.valid = valid
+    self.rows = rows
+    self.landing_heights = landing_heights
+    self.rows_cleared = rows_cleared
+    self.next_fits = next_fits
+
+  # Scores every placement against a weight vector (see
+  # evaluator.weight_vector()), as evaluator.GreedyPolicy does, and returns
+  # the best pose on each board.
+  def best(self, weights):
+    n = self.valid.size
+    scores = evaluator.score(self.rows.reshape(n, ROWS),
+                             self.landing_heights.reshape(n),
+                             self.rows_cleared.reshape(n), weights)
+    scores = np.where(self.next_fits, scores.reshape(self.valid.shape), evaluator.MIN_SCORE)
+    scores = np.where(self.valid, scores, -np.inf)
+    return scores.argmax(axis=1)
+
+# K games played in lockstep, one per seed. The boards are a K x ROWS array
+# of row bitmasks, and each step places one block on every live board:
+#
+#   games = VectorGames(seeds)
+#   while games.alive.any():
+#     expansion = games.expand()
+#     games.step(expansion, expansion.best(weights))
+#
+# Blocks are drawn as Board(seed) draws them, and a placement has the same
+# result as sending its commands() to a Board, so each game is the game a
+# Board would play with the same placements. Only placements that rotate at
+# the spawn position and then move sideways are generated; see
+# PlacementTable.
+class VectorGames(object):
+  def __init__(self, seeds):
+    self.seeds = list(seeds)
+    k = len(self.seeds)
+    self.rows = np.zeros((k, ROWS), dtype=np.uint16)
+    self.scores = np.zeros(k, dtype=np.int64)
+    self.moves = np.zeros(k, dtype=np.int64)
+    self.alive = np.ones(k, dtype=bool)
+    self.tables = PlacementTables()
+    self.thresholds = np.zeros((0, len(types) - 1))
+    self.generators = [seeded_generator(seed) for seed in self.seeds]
+    self.draws = np.zeros((k, 0))
+    self.drawn = 0
+    # The current block and the preview, as block types. Board also draws a
+    # held block after the first one, which is never used.
+    blocks = [self.draw_blocks(np.arange(k))]
+    self.draw_blocks(np.arange(k))
+    blocks += [self.draw_blocks(np.arange(k)) for i in range(PREVIEW)]
+    self.blocks = np.column_stack(blocks)
+
+  # Draws the next block type of the given boards, as Board.get_block() does
+  # with each board's current score. Every board draws in lockstep, so all
+  # of them share the position in the stream of random numbers.
+  def draw_blocks(self, boards):
+    if self.drawn == self.draws.shape[1]:
+      self.draws = np.array([generator.random_sample(2*CHUNK) for generator in self.generators])
+      self.drawn = 0
+    p = self.draws[boards, self.drawn]
+    q = self.draws[boards, self.drawn + 1]
+    self.drawn += 2
+
+    scores = self.scores[boards]
+    if scores.max() >= len(self.thresholds):
+      self.thresholds = np.array([list(level_thresholds(score)) for score in range(2*scores.max() + 1)])
+    above = p[:, np.newaxis] > self.thresholds[scores]
+    levels = np.where(above.any(axis=1), above.argmax(axis=1), len(types) - 1)
+    return (q*np.array(types)[levels]).astype(np.intp)
+
+  def expand(self):
+    boards = np.flatnonzero(self.alive)
+    rows = self.rows[boards]
+    slots = self.tables.lookup(self.blocks[boards, 0])
+    next_slots = self.tables.lookup(self.blocks[boards, 1])
+    tables = self.tables
+    n = np.arange(len(boards))[:, np.newaxis, np.newaxis]
+
+    filled = evaluator.unpack_rows(rows)
+    # The first filled row at or below each square, or ROWS.
+    below = np.where(filled, np.arange(ROWS)[:, np.newaxis], ROWS)
+    below = np.minimum.accumulate(below[:, ::-1], axis=1)[:, ::-1]
+
+    cell_rows = tables.cell_rows[slots]
+    cell_cols = tables.cell_cols[slots]
+    blocked = filled[n, cell_rows, cell_cols].any(axis=2)
+    valid = tables.placement[slots] & ~(blocked[:, np.newaxis, :] & tables.path[slots]).any(axis=2)
+
+    # A piece falls until one of its cells meets a filled square.
+    rows_free = (below[n, cell_rows, cell_cols] - cell_rows).min(axis=2) - 1
+    rows_free = np.where(valid, rows_free, 0)
+    landing_heights = np.repeat(tables.landing_height[next_slots][:, np.newaxis], POSES, axis=1)
+
+    placed = np.zeros(valid.shape + (ROWS + MAX_BLOCK_SIZE,), dtype=np.uint16)
+    placed[:, :, :ROWS] = rows[:, np.newaxis, :]
+    landed = (tables.top[slots] + rows_free)[:, :, np.newaxis] + np.arange(MAX_BLOCK_SIZE)
+    placed[n, np.arange(POSES)[:, np.newaxis], landed] |= tables.masks[slots]
+    placed = placed[:, :, :ROWS]
+
+    full = placed == FULL_ROW
+    rows_cleared = full.sum(axis=2)
+    clears = np.nonzero(rows_cleared)
+    if len(clears[0]):
+      # Sorting the full rows first keeps the others in order below them,
+      # and the full rows are then emptied.
+      order = np.argsort(~full[clears], axis=1, kind='mergesort')
+      kept = np.take_along_axis(placed[clears], order, axis=1)
+      kept[np.arange(ROWS) < rows_cleared[clears][:, np.newaxis]] = 0
+      placed[clears] = kept
+
+    # The squares of the next block at its spawn position, on every placement.
+    spawns = np.array(centers[1::2][:types[-1]])[self.blocks[boards, 1]]
+    next_rows = tables.cell_rows[next_slots, spawns]
+    next_cols = tables.cell_cols[next_slots, spawns]
+    next_squares = placed[n[:, :, 0], :, next_rows] >> next_cols[:, :, np.newaxis].astype(np.uint16)
+    next_fits = ~(next_squares & 1).astype(bool).any(axis=1)
+    return Expansion(boards, valid, placed, landing_heights, rows_cleared, next_fits)
+
+  # Plays the given pose of the expansion on each of its boards. A game ends
+  # when the next block does not fit at its spawn position; like on the
+  # server, the move that ends it is not counted.
+  def step(self, expansion, poses):
+    boards = expansion.boards
+    n = np.arange(len(boards))
+    self.rows[boards] = expansion.rows[n, poses]
+    self.scores[boards] += 2**expansion.rows_cleared[n, poses] - 1
+    self.blocks[boards, :-1] = self.blocks[boards, 1:]
+    self.blocks[boards, -1] = self.draw_blocks(boards)
+
+    slots = self.tables.lookup(self.blocks[boards, 0])
+    spawns = centers[1::2][:types[-1]]
+    spawns = np.array(spawns)[self.blocks[boards, 0]]
+    filled = evaluator.unpack_rows(self.rows[boards])
+    cells = (n[:, np.newaxis], self.tables.cell_rows[slots, spawns], self.tables.cell_cols[slots, spawns])
+    failed = filled[cells].any(axis=1)
+    self.alive[boards[failed]] = False
+    self.moves[boards[~failed]] += 1
+
+# Plays a game per seed with the greedy policy of a weight vector, all in
+# lockstep, and returns the final scores and the number of moves of each.
+# Games still going after max_moves are stopped there.
+def play_greedy(seeds, weights, max_moves=None):
+  games = VectorGames(seeds)
+  move = 0
+  while games.alive.any() and (max_moves is None or move < max_moves):
+    expansion = games.expand()
+    games.step(expansion, expansion.best(weights))
+    move += 1
+  return (games.scores, games.moves)
@@ -0,0 +1,305 @@
+import heapq
+import random
+
+from Block import (
+  COLS,
+  ROWS,
+  orientations,
+)
+from Piece import Piece
+
+FULL_ROW = (1 << COLS) - 1
+
+# Zobrist keys. Each square (i, j) has a random 64-bit key, and a board's hash
+# is the XOR of the keys of its occupied squares. To hash a row bitmask with
+# table lookups, the keys are combined per row into a table for the low and
+# the high half of the mask. The keys are seeded so that hashes agree between
+# processes.
+ZOBRIST_SEED = 0x5eed
+HALF = (COLS + 1)/2
+MASK64 = (1 << 64) - 1
+
+def build_zobrist_keys():
+  generator = random.Random(ZOBRIST_SEED)
+  low_keys = []
+  high_keys = []
+  for i in range(ROWS):
+    keys = [generator.getrandbits(64) for j in range(COLS)]
+    for (table, shift, bits) in ((low_keys, 0, HALF), (high_keys, HALF, COLS - HALF)):
+      row = [0]*(1 << bits)
+      for mask in range(1, 1 << bits):
+        low = mask & -mask
+        row[mask] = row[mask ^ low] ^ keys[shift + low.bit_length() - 1]
+      table.append(row)
+  return (low_keys, high_keys)
+
+(LOW_KEYS, HIGH_KEYS) = build_zobrist_keys()
+
+def row_hash(i, mask):
+  return LOW_KEYS[i][mask & ((1 << HALF) - 1)] ^ HIGH_KEYS[i][mask >> HALF]
+
+# A 64-bit key for a piece's type, orientation and position, to be combined
+# with a board hash when the current piece is part of a position.
+def piece_hash(piece):
+  return (hash((piece.type, piece.orientation, piece.i, piece.j))*
+          0x9e3779b97f4a7c15) & MASK64
+
+# Converts a bitmap (a list of ROWS lists of COLS squares) into a list of row
+# bitmasks, with bit j set if square j of the row is occupied.
+def rows_from_bitmap(bitmap):
+  return [sum(1 << j for j in range(COLS) if row[j]) for row in bitmap]
+
+# The occupancy of a board. Each row is stored as a COLS-bit integer, with bit
+# j set if column j is occupied. Alongside it, the skyline is kept up to date:
+# the row of the highest occupied square in each column (ROWS if the column is
+# empty), and the number of empty squares below it. The Zobrist hash of the
+# occupied squares is also updated on every landing and clear.
+class Bitboard(object):
+  def __init__(self, rows=None):
+    self.rows = list(rows) if rows is not None else [0]*ROWS
+    self._tops = [ROWS]*COLS
+    self._holes = [0]*COLS
+    self.hash = 0
+    if rows is not None:
+      self.compute_skyline()
+      self.hash = self.compute_hash()
+
+  # The height of each column, measured from the floor to the top of its
+  # highest occupied square.
+  @property
+  def heights(self):
+    return tuple(ROWS - top for top in self._tops)
+
+  # The number of empty squares below the highest occupied square of each
+  # column.
+  @property
+  def holes(self):
+    return tuple(self._holes)
+
+  def compute_skyline(self):
+    for j in range(COLS):
+      bit = 1 << j
+      column = [i for i in range(ROWS) if self.rows[i] & bit]
+      self._tops[j] = column[0] if column else ROWS
+      self._holes[j] = ROWS - self._tops[j] - len(column)
+
+  def compute_hash(self):
+    hash = 0
+    for (i, row) in enumerate(self.rows):
+      if row:
+        hash ^= row_hash(i, row)
+    return hash
+
+  # The hash of this board with the given piece on it, for keying positions
+  # where the piece to play matters.
+  def key(self, piece=None):
+    if piece is None:
+      return self.hash
+    return self.hash ^ piece_hash(piece)
+
+  def check(self, block):
+    return self.fits(block.geometry, block.i, block.j)
+
+  # Returns True if the given orientation, centered at (i, j), is in bounds
+  # and does not overlap any occupied square.
+  def fits(self, orientation, i, j):
+    top = i + orientation.min_i
+    left = j + orientation.min_j
+    if (top < 0 or top + orientation.height > ROWS or
+        left < 0 or left + orientation.width > COLS):
+      return False
+    rows = self.rows
+    k = 0
+    for mask in orientation.masks:
+      if rows[top + k] & (mask << left):
+        return False
+      k += 1
+    return True
+
+  # Returns True if the given orientation, centered in row i, fits in every
+  # column from j to j2, so that left or right commands can move it from one
+  # to the other. The squares it sweeps across are tested with one mask per
+  # row rather than once per column.
+  def fits_across(self, orientation, i, j, j2):
+    if j > j2:
+      (j, j2) = (j2, j)
+    if not (self.fits(orientation, i, j) and self.fits(orientation, i, j2)):
+      return False
+    rows = self.rows
+    top = i + orientation.min_i
+    left = j + orientation.min_j
+    span = j2 - j
+    k = 0
+    for mask in orientation.masks:
+      # Smear the mask over span more columns by doubling.
+      swept = mask
+      covered = 0
+      while covered < span:
+        step = min(covered + 1, span - covered)
+        swept |= swept << step
+        covered += step
+      if rows[top + k] & (swept << left):
+        return False
+      k += 1
+    return True
+
+  # Returns True if the piece can be moved from start to target with left,
+  # right, up, down and rotate commands, each of which leaves it in a valid
+  # position. The direct paths are tried first: moving down some rows,
+  # rotating there, moving sideways and then dropping to the target row. If
+  # those are blocked, the positions reachable from start are searched.
+  def reachable(self, start, target):
+    if start.type != target.type or not self.check(start) or not self.check(target):
+      return False
+    table = orientations(start.type)
+    fits = self.fits
+    rotations = []
+    o = start.orientation
+    while o != target.orientation:
+      o = table[o].next
+      rotations.append(table[o])
+    geometry = target.geometry
+    for i in range(start.i, min(start.i + self.rows_free(start), target.i) + 1):
+      if (all(fits(orientation, i, start.j) for orientation in rotations) and
+          self.fits_across(geometry, i, start.j, target.j) and
+          self.rows_free(Piece(target.type, target.orientation, i, target.j)) >= target.i - i):
+        return True
+
+    # Positions nearest the target are searched first, which usually finds
+    # tucks under overhangs without visiting most of the board.
+    goal = (target.i, target.j, target.orientation)
+    distance = lambda (i, j, o): (abs(i - goal[0]) + abs(j - goal[1]) +
+                                  (goal[2] - o) % len(table))
+    pose = (start.i, start.j, start.orientation)
+    seen = set([pose])
+    queue = [(distance(pose), pose)]
+    while queue:
+      (i, j, o) = heapq.heappop(queue)[1]
+      for pose in ((i, j - 1, o), (i, j + 1, o), (i + 1, j, o), (i - 1, j, o),
+                   (i, j, table[o].next)):
+        if pose not in seen and fits(table[pose[2]], pose[0], pose[1]):
+          if pose == goal:
+            return True
+          seen.add(pose)
+          heapq.heappush(queue, (distance(pose), pose))
+    return False
+
+  # Returns the number of rows the block would drop, or -1 if it is not in a
+  # valid position. A block that is entirely above the skyline lands where its
+  # bottom contour first meets the skyline. Blocks tucked under an overhang
+  # are slid down one row at a time.
+  def rows_free(self, block):
+    orientation = block.geometry
+    top = block.i + orientation.min_i
+    left = block.j + orientation.min_j
+    if (top < 0 or top + orientation.height > ROWS or
+        left < 0 or left + orientation.width > COLS):
+      return -1
+    landing = self.landing(orientation, block.j)
+    if block.i > landing:
+      return self.slide(block)
+    return landing - block.i
+
+  # Returns the row of the center of the given orientation, centered in
+  # column j, after it is dropped from above the skyline: the highest row at
+  # which its bottom contour rests on the top of some column.
+  def landing(self, orientation, j):
+    tops = self._tops
+    left = j + orientation.min_j
+    landing = ROWS
+    c = 0
+    for bottom in orientation.bottom:
+      row = tops[left + c] - bottom
+      if row < landing:
+        landing = row
+      c += 1
+    return landing - 1 - orientation.min_i
+
+  def slide(self, block):
+    orientation = block.geometry
+    if not self.fits(orientation, block.i, block.j):
+      return -1
+    top = block.i + orientation.min_i
+    left = block.j + orientation.min_j
+    height = orientation.height
+    shifted = [mask << left for mask in orientation.masks]
+    rows = self.rows
+    drop = 0
+    while top + drop + height < ROWS:
+      base = top + drop + 1
+      for k in range(height):
+        if rows[base + k] & shifted[k]:
+          return drop
+      drop += 1
+    return drop
+
+  # Marks the squares of the block, moved down by rows_free, as occupied and
+  # updates the skyline. Returns the top row the block landed in.
+  def land(self, block, rows_free):
+    rows = self.rows
+    tops = self._tops
+    holes = self._holes
+    orientation = block.geometry
+    top = block.i + orientation.min_i + rows_free
+    left = block.j + orientation.min_j
+    hash = self.hash
+    i = top
+    for mask in orientation.masks:
+      rows[i] |= mask << left
+      hash ^= row_hash(i, mask << left)
+      i += 1
+    self.hash = hash
+
+    above = {}
+    for (i, j) in block.cells():
+      i += rows_free
+      if i > tops[j]:
+        holes[j] -= 1
+      elif j in above:
+        above[j] = (min(above[j][0], i), above[j][1] + 1)
+      else:
+        above[j] = (i, 1)
+    # Squares between the new and the old top of a column that the block did
+    # not fill are new holes.
+    for j, (row, count) in above.iteritems():
+      holes[j] += tops[j] - row - count
+      tops[j] = row
+    return top
+
+  # Removes the full rows among the given ones, shifting the rows above them
+  # down, and returns their indices in increasing order. Only the rows a
+  # block landed in can become full, so callers pass just those.
+  def clear_rows(self, rows):
+    full = [i for i in rows if self.rows[i] == FULL_ROW]
+    # Moving rows in increasing order leaves the later indices unchanged.
+    for i in full:
+      del self.rows[i]
+      self.rows.insert(0, 0)
+    if full:
+      self.update_skyline(full)
+      # Every row above the cleared ones moved, so rehash from scratch.
+      self.hash = self.compute_hash()
+    return full
+
+  # Updates the skyline after the given rows were cleared. Cleared rows are
+  # always at or below a column's top, so the top just moves down, unless the
+  # top square itself was cleared. Then the empty squares above the next
+  # occupied square are no longer holes.
+  def update_skyline(self, cleared):
+    n = len(cleared)
+    rows = self.rows
+    tops = self._tops
+    holes = self._holes
+    for j in range(COLS):
+      top = tops[j]
+      if top == ROWS:
+        continue
+      if top not in cleared:
+        tops[j] = top + n
+        continue
+      bit = 1 << j
+      i = top + n
+      while i < ROWS and not rows[i] & bit:
+        i += 1
+      holes[j] -= i - (top + n)
+      tops[j] = i
@@ -1,3 +1,5 @@
+from array import array
+
 from RawBlockData import raw_block_data
 
 COLS = 12
@@ -6,33 +8,103 @@ ROWS = 33
 MAX_BLOCK_SIZE = 10
 
 types = []
-blocks = []
+
+# The catalog is stored in flat arrays. The offsets of block type t are the
+# (i, j) pairs in offset_data[2*offset_index[t]:2*offset_index[t + 1]], its
+# spawn center is centers[2*t:2*t + 2].
+offset_index = array('i', [0])
+offset_data = array('b')
+centers = array('b')
 
 def loadBlockData():
   types.extend(raw_block_data[0][1:])
   if len(types) != raw_block_data[0][0]:
     print "Read an incorrect number of difficulty levels."
 
-  for i in range(1, types[-1] + 1):
-    data = raw_block_data[i]
-    blocks.append({
-      'type': i - 1,
-      'center': {
-        'i': data[1],
-        'j': data[0],
-      },
-      'offsets': [{
-        'i': data[2*j + 4],
-        'j': data[2*j + 3],
-      } for j in range(data[2])],
-    })
-
-  for block in blocks:
-    block['center']['i'] += MAX_BLOCK_SIZE - height(block)
-    block['center']['j'] += COLS/2
-
-def height(block):
-  return (max(offset['i'] for offset in block['offsets'])
-          - min(offset['i'] for offset in block['offsets']) + 1)
+  for data in raw_block_data[1:types[-1] + 1]:
+    offsets = data[3:2*data[2] + 3]
+    i_offsets = offsets[1::2]
+    j_offsets = offsets[0::2]
+    offsets[0::2] = i_offsets
+    offsets[1::2] = j_offsets
+    offset_data.extend(offsets)
+    offset_index.append(offset_index[-1] + data[2])
+
+    min_i = min(i_offsets)
+    max_i = max(i_offsets)
+    centers.append(data[1] + MAX_BLOCK_SIZE - (max_i - min_i + 1))
+    centers.append(data[0] + COLS/2)
+
+# One rotation of a block type. Offsets are (i, j) pairs relative to the
+# block's center. The piece's cells cover rows min_i to min_i + height - 1
+# and columns min_j to min_j + width - 1 relative to the center, and:
+#   masks[k]: the bitmask of row min_i + k, with bit c for column min_j + c.
+#   bottom[c]: the lowest row of column min_j + c, relative to min_i.
+#   next: the index of the orientation reached by one rotation.
+#   shape: the index of the first orientation covering the same cells up to
+#     a translation. Orientations with shape == index are canonical.
+class Orientation(object):
+  __slots__ = ('offsets', 'min_i', 'min_j', 'height', 'width', 'masks',
+               'bottom', 'next', 'shape')
+
+  def __init__(self, offsets):
+    self.offsets = offsets
+    self.min_i = min(i for (i, j) in offsets)
+    self.min_j = min(j for (i, j) in offsets)
+    self.height = max(i for (i, j) in offsets) - self.min_i + 1
+    self.width = max(j for (i, j) in offsets) - self.min_j + 1
+    masks = [0]*self.height
+    bottom = [-1]*self.width
+    for (i, j) in offsets:
+      masks[i - self.min_i] |= 1 << (j - self.min_j)
+      bottom[j - self.min_j] = max(bottom[j - self.min_j], i - self.min_i)
+    self.masks = tuple(masks)
+    self.bottom = tuple(bottom)
+    self.next = 0
+    self.shape = 0
+
+  def normalized(self):
+    return frozenset((i - self.min_i, j - self.min_j) for (i, j) in self.offsets)
+
+orientation_tables = {}
+orientation_indices = {}
+
+def build_orientations(type):
+  start = 2*offset_index[type]
+  end = 2*offset_index[type + 1]
+  offsets = tuple(zip(offset_data[start:end:2], offset_data[start + 1:end:2]))
+  table = []
+  cells = {}
+  indices = {}
+  # Rotating four times is the identity, but symmetric blocks repeat the same
+  # cells sooner (possibly listing the offsets in a different order).
+  for rotation in range(4):
+    if frozenset(offsets) not in cells:
+      cells[frozenset(offsets)] = len(table)
+      table.append(Orientation(offsets))
+    indices[offsets] = cells[frozenset(offsets)]
+    offsets = tuple((j, -i) for (i, j) in offsets)
+  for k, orientation in enumerate(table):
+    orientation.next = (k + 1) % len(table)
+    normalized = orientation.normalized()
+    orientation.shape = min(
+        m for m in range(len(table)) if table[m].normalized() == normalized)
+  orientation_indices[type] = indices
+  orientation_tables[type] = tuple(table)
+
+# Returns the distinct orientations of a block type, starting with its spawn
+# orientation. The table is built on first use and cached.
+def orientations(type):
+  if type not in orientation_tables:
+    build_orientations(type)
+  return orientation_tables[type]
+
+# Returns the index of a block dict's orientation in orientations(type).
+def orientation_index(block):
+  type = block['type']
+  if type not in orientation_tables:
+    build_orientations(type)
+  key = tuple((offset['i'], offset['j']) for offset in block['offsets'])
+  return orientation_indices[type][key]
 
 loadBlockData()
@@ -1,13 +1,17 @@
-from copy import deepcopy
 import math
 import random
 
+from Bitboard import (
+  Bitboard,
+  FULL_ROW,
+  rows_from_bitmap,
+)
 from Block import (
   COLS,
   ROWS,
   types,
-  blocks,
 )
+from Piece import Piece
 
 LEVEL_INTERVAL = 60
 MIN_R = 0.1
@@ -16,7 +20,24 @@ R_INTERVAL = 480
 
 PREVIEW = 5
 
-class Board(object):
+EMPTY_ROW = (0,)*COLS
+
+# Yields the thresholds get_block() compares its first random number p
+# against at the given score, in order. The block comes from level i for the
+# first i with p > thresholds[i], and from the last level if there is no
+# such i. They are computed as they are asked for, so that get_block() stops
+# at the first threshold p passes.
+def level_thresholds(score):
+  # Calculate the ratio r between the probability of different levels.
+  x = 2.0*(score - R_INTERVAL)/R_INTERVAL
+  r = (MAX_R - MIN_R)*(x/math.sqrt(x*x + 1) + 1)/2 + MIN_R
+
+  # Each level's threshold is a sigmoid of the score, scaled by r.
+  for i in range(1, len(types)):
+    x = 2.0 * (score - i*LEVEL_INTERVAL)/LEVEL_INTERVAL
+    yield (r**i)*(x/math.sqrt(x*x + 1) + 1)/2
+
+class Board(Bitboard):
   def __init__(self, seed):
     self.seed = seed
     self.random = random.Random()
@@ -25,6 +46,8 @@ class Board(object):
     self.score = 0
     self.state = 'playing'
 
+    # The colored bitmap is kept alongside the row bitmasks for to_dict().
+    Bitboard.__init__(self)
     self.bitmap = [[0 for j in range(COLS)] for i in range(ROWS)]
     self.block = self.get_block()
     self.held_block = self.get_block()
@@ -36,9 +59,7 @@ class Board(object):
   def __str__(self):
     bitmap = [['X' if elt else '.' for elt in row] for row in self.bitmap]
     if self.block:
-      for point in self.block['offsets']:
-        i = point['i'] + self.block['center']['i']
-        j = point['j'] + self.block['center']['j']
+      for (i, j) in self.block.cells():
         bitmap[i][j] = 'O'
     board_str = '\n'.join(''.join(row) for row in bitmap)
     state = '%s%s' % (self.state[0].upper(), self.state[1:])
@@ -49,42 +70,59 @@ class Board(object):
     return {
       'state': self.state,
       'bitmap': self.bitmap,
-      'block': self.block,
-      'preview': self.preview,
+      'block': self.block.to_dict(),
+      'preview': [block.to_dict() for block in self.preview],
       'score': self.score,
     }
 
-  def check(self, block):
-    for point in block['offsets']:
-      i = point['i'] + block['center']['i']
-      j = point['j'] + block['center']['j']
-      if i < 0 or i >= ROWS or j < 0 or j >= COLS or self.bitmap[i][j]:
-        return False
-    return True
+  # A board in the position of a state dict from to_dict(). No blocks are
+  # drawn to build it. Those drawn after the preview come from a generator
+  # seeded with `seed`, so they are not the ones the original board would
+  # have drawn.
+  @staticmethod
+  def from_dict(state, seed=0):
+    board = Board.__new__(Board)
+    board.seed = seed
+    board.random = random.Random(seed)
+    board.held_block = None
+    board.bitmap = [list(row) for row in state['bitmap']]
+    Bitboard.__init__(board, rows_from_bitmap(board.bitmap))
+    board.block = Piece.from_dict(state['block'])
+    board.preview = [Piece.from_dict(block) for block in state['preview']]
+    board.score = state['score']
+    board.state = state['state']
+    return board
 
   def get_block(self):
-    level = len(types) - 1
-
-    # Calculate the ratio r between the probability of different levels.
+    # Pick a difficulty level by comparing p to the thresholds of each level.
     p = self.random.random()
-    x = 2.0*(self.score - R_INTERVAL)/R_INTERVAL
-    r = (MAX_R - MIN_R)*(x/math.sqrt(x*x + 1) + 1)/2 + MIN_R
-
-    # Run through the levels and compare p to a sigmoid for each level.
-    for i in range(1, len(types)):
-      x = 2.0 * (self.score - i*LEVEL_INTERVAL)/LEVEL_INTERVAL
-      if p > (r**i)*(x/math.sqrt(x*x + 1) + 1)/2:
-        level = i - 1
+    level = len(types) - 1
+    for (i, threshold) in enumerate(level_thresholds(self.score)):
+      if p > threshold:
+        level = i
         break
-    
+
     # Return a block of the appropriate difficuly level.
     type = int(self.random.random()*types[level])
-    return deepcopy(blocks[type])
+    return Piece.spawn(type)
 
   def send_commands(self, commands):
     if self.state != 'playing':
       return
 
+    commands.append('drop')
+    self.block = self.move(self.block, commands)
+    self.place()
+
+  # Returns where the commands move the block, up to the first drop.
+  # Commands that would leave the block in an invalid position are skipped.
+  # A run of the same command is played in one step where possible: a run of
+  # left or right commands moves the whole way if fits_across() says nothing
+  # is in the way, and a run of downs moves min(run, rows_free()) rows. Only
+  # runs that are blocked part of the way are played one command at a time.
+  # A blocked command leaves the block where it is, so every later command of
+  # the run is blocked too.
+  def move(self, block, commands):
     commands_dict = {
       'rotate': Board.rotate,
       'left': Board.left,
@@ -92,12 +130,22 @@ class Board(object):
       'up': Board.up,
       'down': Board.down,
     }
-    commands.append('drop')
-    for command in commands:
-      if command in commands_dict:
-        block = commands_dict[command](self.block)
-        if self.check(block):
-          self.block = block
+    k = 0
+    while k < len(commands):
+      command = commands[k]
+      run = k + 1
+      while run < len(commands) and commands[run] == command:
+        run += 1
+      count = run - k
+      k = run
+      if command == 'left' or command == 'right':
+        j = block.j - count if command == 'left' else block.j + count
+        if self.fits_across(block.geometry, block.i, block.j, j):
+          block = block.translate(j=j - block.j)
+          continue
+      elif command == 'down':
+        block = block.translate(i=min(count, self.rows_free(block)))
+        continue
       elif command == 'hold':
         continue
         #block = deepcopy(self.held_block)
@@ -107,51 +155,68 @@ class Board(object):
         #  self.held_block = self.block
         #  self.block = block
       elif command == 'drop':
-        self.place()
         break
+      if command in commands_dict:
+        for n in range(count):
+          moved = commands_dict[command](block)
+          if not self.check(moved):
+            break
+          block = moved
+    return block
+
+  # Plays the block from the given position, a Piece of the same type, and
+  # drops it. This is the same as sending commands that move the block
+  # there. If given, the commands are tried first, and the position is taken
+  # as reached if they move the block somewhere it lands the same way.
+  # Otherwise reachable() checks that some commands lead there. Returns
+  # False, and leaves the board as it is, if none do.
+  def send_placement(self, piece, commands=None):
+    if self.state != 'playing':
+      return False
+    if not self.check(piece):
+      return False
+    landed = piece.translate(i=self.rows_free(piece))
+    if commands is not None:
+      moved = self.move(self.block, commands)
+      reached = moved.translate(i=self.rows_free(moved)) == landed
+    else:
+      reached = False
+    if not reached and not self.reachable(self.block, piece):
+      return False
+    self.block = landed
+    self.place()
+    return True
 
   def place(self):
     rows_free = self.rows_free(self.block)
-    for point in self.block['offsets']:
-      i = point['i'] + self.block['center']['i'] + rows_free
-      j = point['j'] + self.block['center']['j']
-      self.bitmap[i][j] = self.block['type'] + 1
-    self.remove_rows()
+    top = self.land(self.block, rows_free)
+    for (i, j) in self.block.cells():
+      self.bitmap[i + rows_free][j] = self.block.type + 1
+    self.remove_rows(range(top, top + self.block.geometry.height))
 
     self.block = self.preview.pop(0)
     self.preview.append(self.get_block())
     if self.rows_free(self.block) < 0:
       self.state = 'failed'
 
-  def rows_free(self, block):
-    temp_block = deepcopy(block)
-    while self.check(temp_block):
-      temp_block['center']['i'] += 1
-    return temp_block['center']['i'] - block['center']['i'] - 1
-
-  def remove_rows(self):
-    self.bitmap = [row for row in self.bitmap if not all(row)]
-    num_rows_cleared = ROWS - len(self.bitmap)
-    self.score += 2**num_rows_cleared - 1
-    self.bitmap = [[0 for j in range(COLS)] for i in range(num_rows_cleared)] + self.bitmap
+  # Removes full rows and scores them. Only the given rows are tested, which
+  # after a drop are the rows the block landed in. Cleared rows are recycled
+  # as empty rows at the top of the board.
+  def remove_rows(self, rows=range(ROWS)):
+    full = self.clear_rows(rows)
+    for i in full:
+      row = self.bitmap.pop(i)
+      row[:] = EMPTY_ROW
+      self.bitmap.insert(0, row)
+    self.score += 2**len(full) - 1
 
   @staticmethod
   def rotate(block):
-    result = deepcopy(block)
-    result['offsets'] = [{
-      'i': offset['j'],
-      'j': -offset['i'],
-    } for offset in result['offsets']]
-    return result
+    return block.rotate()
 
   @staticmethod
   def translate(block, i=0, j=0):
-    result = deepcopy(block)
-    result['center'] = {
-      'i': result['center']['i'] + i,
-      'j': result['center']['j'] + j,
-    }
-    return result
+    return block.translate(i, j)
 
   @staticmethod
   def left(block):
@@ -0,0 +1,82 @@
+from Block import (
+  centers,
+  orientation_index,
+  orientations,
+)
+
+# An immutable block value: its type, the index of its orientation in
+# orientations(type), and the (i, j) position of its center. Moving a piece
+# returns a new piece and never copies offsets; to_dict() builds the block
+# dict sent over JSON.
+class Piece(object):
+  __slots__ = ('type', 'orientation', 'i', 'j')
+
+  def __init__(self, type, orientation, i, j):
+    object.__setattr__(self, 'type', type)
+    object.__setattr__(self, 'orientation', orientation)
+    object.__setattr__(self, 'i', i)
+    object.__setattr__(self, 'j', j)
+
+  def __setattr__(self, name, value):
+    raise AttributeError('Piece is immutable')
+
+  def __delattr__(self, name):
+    raise AttributeError('Piece is immutable')
+
+  def __eq__(self, other):
+    return (isinstance(other, Piece) and self.type == other.type and
+            self.orientation == other.orientation and
+            self.i == other.i and self.j == other.j)
+
+  def __ne__(self, other):
+    return not self == other
+
+  def __hash__(self):
+    return hash((self.type, self.orientation, self.i, self.j))
+
+  def __repr__(self):
+    return 'Piece(%d, %d, %d, %d)' % (self.type, self.orientation, self.i, self.j)
+
+  def __reduce__(self):
+    return (Piece, (self.type, self.orientation, self.i, self.j))
+
+  def __copy__(self):
+    return self
+
+  def __deepcopy__(self, memo):
+    return self
+
+  # The piece's Orientation, with its offsets, row masks and bottom contour.
+  @property
+  def geometry(self):
+    return orientations(self.type)[self.orientation]
+
+  def cells(self):
+    return [(self.i + i, self.j + j) for (i, j) in self.geometry.offsets]
+
+  def rotate(self):
+    next = orientations(self.type)[self.orientation].next
+    return Piece(self.type, next, self.i, self.j)
+
+  def translate(self, i=0, j=0):
+    return Piece(self.type, self.orientation, self.i + i, self.j + j)
+
+  def to_dict(self):
+    return {
+      'type': self.type,
+      'center': {
+        'i': self.i,
+        'j': self.j,
+      },
+      'offsets': [{'i': i, 'j': j} for (i, j) in self.geometry.offsets],
+    }
+
+  # A new piece of the given type in its spawn orientation and position.
+  @staticmethod
+  def spawn(type):
+    return Piece(type, 0, centers[2*type], centers[2*type + 1])
+
+  @staticmethod
+  def from_dict(block):
+    return Piece(block['type'], orientation_index(block),
+                 block['center']['i'], block['center']['j'])
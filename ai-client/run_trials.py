@@ -1,30 +1,48 @@
-import subprocess
 import random
-import re
-import tempfile
-import os
-import threading
 import sys
 
-def run_trial(seed=random.randint(0, 1024)):
-    print 'running trial with seed ' + str(seed)
-
-    process = subprocess.Popen(['./unmodified_client.py', 'local', str(seed)],
-            stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-    stdout, stderr = process.communicate()
+from batch import (
+    BatchSimulator,
+    WorkerPolicy,
+)
+from client import (
+    CpuClock,
+    FixedClock,
+)
+from helpers.evaluator import (
+    GreedyPolicy,
+    LookaheadPolicy,
+    load_weights,
+)
+import util
 
-    print stdout
+def run_trial(simulator, seed=random.randint(0, 1024)):
+    print 'running trial with seed ' + str(seed)
 
-    m = re.search('RESULTS: (\d+)', stdout)
+    result = simulator.play(seed)
 
-    try:
-        print 'trial with seed ' + seed + ' finished with result ' + m.group(1)
-        return int(m.group(1))
-    except:
-        return 0
+    print 'trial with seed ' + str(seed) + ' finished with result ' + str(result.score)
+    print result
+    return result.score
 
 if __name__ == '__main__':
+    # The AI is LookaheadPolicy, the C++ AI's search run in this process,
+    # with the weights in weights.txt. --greedy selects the greedy policy
+    # with the same weights, and a module:callable names a plugin; these are
+    # charged their CPU time. --worker plays the C++ AI itself in a worker
+    # process, charged a fixed second per move.
+    if len(sys.argv) < 2:
+        policy = LookaheadPolicy(load_weights('weights.txt'), placements=True)
+        simulator = BatchSimulator(policy, clock=CpuClock())
+    elif sys.argv[1] == '--greedy':
+        policy = GreedyPolicy(load_weights('weights.txt'), placements=True)
+        simulator = BatchSimulator(policy, clock=CpuClock())
+    elif sys.argv[1] == '--worker':
+        simulator = BatchSimulator(WorkerPolicy('weights.txt'), clock=FixedClock(1))
+    else:
+        simulator = BatchSimulator(util.load_callable(sys.argv[1]), clock=CpuClock())
+
     score = 0
 
     while score < 400:
-        score = run_trial(random.randint(0, 1024))
+        score = run_trial(simulator, random.randint(0, 1024))
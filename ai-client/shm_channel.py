@@ -0,0 +1,201 @@
+#!/usr/bin/env python
+#
+# A shared-memory channel between the client and a persistent AI process.
+# Both map the same file (in /dev/shm on Linux, so it never touches a disk).
+# The client writes each game state into the next slot of a ring of fixed
+# layout slots and then bumps a sequence counter; the AI sees the counter
+# change, reads the state in place, writes its commands into the same slot
+# and bumps a second counter. No data goes through a pipe or a syscall.
+#
+# States are written in the compact encoding of encoding.py, and commands as
+# one byte each, their index in COMMANDS.
+#
+# An AI is run on the channel with
+#
+#   shm_channel.py <module:callable> <mapping path>
+#
+# where the callable is called like an AIPlugin, with the state dict and a
+# util.Deadline, and returns a list of commands.
+#
+
+import mmap
+import multiprocessing
+import os
+import platform
+import struct
+import sys
+import tempfile
+import time
+from subprocess import Popen
+
+import encoding
+import util
+
+is_windows = platform.system() == "Windows"
+
+# The commands, in the order of client.VALID_CMDS.
+COMMANDS = ['left', 'right', 'up', 'down', 'rotate']
+
+MAGIC = 'DBXS'
+# Magic, number of slots, number of the last state written and number of the
+# last state answered. States are numbered from 1; state n is in slot n % slots.
+HEADER = struct.Struct('<4sIQQ')
+STATE_SEQ = 8
+COMMANDS_SEQ = 16
+# An encoded state with every square of the board occupied takes 912 bytes.
+MAX_STATE = 1024
+MAX_COMMANDS = 1024
+# Seconds remaining, length of the state, the state, number of commands and
+# the commands.
+SLOT = struct.Struct('<dH%dsH%ds' % (MAX_STATE, MAX_COMMANDS))
+# The commands part of a slot, and where it starts.
+REPLY = struct.Struct('<H%ds' % MAX_COMMANDS)
+REPLY_OFFSET = SLOT.size - REPLY.size
+SEQ = struct.Struct('<Q')
+
+# How long waiting for a counter spins before it starts to sleep, and the
+# shortest and longest sleeps between looks after that. The sleep doubles
+# each time, so that an answer that comes quickly is seen quickly, but a side
+# that is idle does not keep a core busy. With a single core, spinning only
+# keeps the other side from running, so there is none.
+SPIN_SECONDS = 0.0002 if multiprocessing.cpu_count() > 1 else 0
+MIN_SLEEP = 0.00005
+MAX_SLEEP = 0.001
+
+class SharedChannel(object):
+    def __init__(self, path, slots=4, create=False):
+        self.path = path
+        size = HEADER.size + slots*SLOT.size
+        with open(path, 'r+b' if not create else 'w+b') as f:
+            if create:
+                f.truncate(size)
+            self.map = mmap.mmap(f.fileno(), 0)
+        if create:
+            HEADER.pack_into(self.map, 0, MAGIC, slots, 0, 0)
+        (magic, self.slots, _, _) = HEADER.unpack_from(self.map, 0)
+        if magic != MAGIC:
+            raise ValueError('Not a state channel: %s' % path)
+
+    # Creates a channel in a new file, in shared memory where there is some.
+    @staticmethod
+    def create(slots=4):
+        directory = '/dev/shm' if os.path.isdir('/dev/shm') else None
+        (fd, path) = tempfile.mkstemp(prefix='dropblox', dir=directory)
+        os.close(fd)
+        return SharedChannel(path, slots, create=True)
+
+    def close(self, remove=False):
+        self.map.close()
+        if remove:
+            os.unlink(self.path)
+
+    def read_seq(self, offset):
+        return SEQ.unpack_from(self.map, offset)[0]
+
+    def slot(self, seq):
+        return HEADER.size + (seq % self.slots)*SLOT.size
+
+    # Waits until the counter at the offset reaches seq. Returns False if the
+    # deadline passes first, or if alive() returns False.
+    def wait(self, offset, seq, deadline, alive=None):
+        spin_until = time.time() + SPIN_SECONDS
+        sleep = MIN_SLEEP
+        while self.read_seq(offset) < seq:
+            now = time.time()
+            if now >= deadline:
+                return False
+            if now >= spin_until:
+                if alive is not None and not alive():
+                    return False
+                time.sleep(min(sleep, deadline - now))
+                sleep = min(sleep*2, MAX_SLEEP)
+        return True
+
+    # Client side: writes an encoded state and returns its number.
+    def put_state(self, data, seconds):
+        seq = self.read_seq(STATE_SEQ) + 1
+        SLOT.pack_into(self.map, self.slot(seq), seconds, len(data), data, 0, '')
+        SEQ.pack_into(self.map, STATE_SEQ, seq)
+        return seq
+
+    # Client side: returns the commands answered to state seq, or None if
+    # there is no answer before the deadline.
+    def get_commands(self, seq, deadline, alive=None):
+        if not self.wait(COMMANDS_SEQ, seq, deadline, alive):
+            return None
+        (_, _, _, count, commands) = SLOT.unpack_from(self.map, self.slot(seq))
+        return [COMMANDS[ord(c)] for c in commands[:count] if ord(c) < len(COMMANDS)]
+
+    # AI side: waits for state seq and returns (encoded state, seconds).
+    def get_state(self, seq, deadline, alive=None):
+        if not self.wait(STATE_SEQ, seq, deadline, alive):
+            return None
+        (seconds, length, data, _, _) = SLOT.unpack_from(self.map, self.slot(seq))
+        return (data[:length], seconds)
+
+    # AI side: answers state seq.
+    def put_commands(self, seq, cmds):
+        codes = ''.join(chr(COMMANDS.index(cmd)) for cmd in cmds if cmd in COMMANDS)
+        codes = codes[:MAX_COMMANDS]
+        REPLY.pack_into(self.map, self.slot(seq) + REPLY_OFFSET, len(codes), codes)
+        SEQ.pack_into(self.map, COMMANDS_SEQ, seq)
+
+# The client side of an AI process that takes its states over a
+# SharedChannel. It works like client.AIWorker: the AI is started once, with
+# the path of the mapping as its last argument, and restarted if it exits or
+# does not answer a state before the timeout.
+class ShmWorker(object):
+    def __init__(self, cmd, *args):
+        self.cmd = cmd
+        self.args = list(args)
+        self.process = None
+        self.channel = None
+
+    def start(self):
+        self.channel = SharedChannel.create()
+        self.process = Popen([self.cmd] + self.args + [self.channel.path],
+                             close_fds=not is_windows)
+
+    def stop(self):
+        if self.process is None:
+            return
+        try:
+            self.process.kill()
+            self.process.wait()
+        except OSError:
+            pass
+        self.channel.close(remove=True)
+        self.process = None
+
+    def alive(self):
+        return self.process.poll() is None
+
+    def run(self, game_state_dict, seconds, timeout):
+        if self.process is None or not self.alive():
+            self.stop()
+            self.start()
+        seq = self.channel.put_state(encoding.encode_state(game_state_dict), seconds)
+        cmds = self.channel.get_commands(seq, time.time() + timeout, self.alive)
+        if cmds is None:
+            self.stop()
+            return []
+        return cmds
+
+# AI side: answers every state that arrives on the channel at the path with
+# the given callable, until the client goes away.
+def serve(path, ai):
+    channel = SharedChannel(path)
+    client_pid = os.getppid()
+    alive = lambda: os.getppid() == client_pid
+    seq = channel.read_seq(COMMANDS_SEQ) + 1
+    while True:
+        request = channel.get_state(seq, float('inf'), alive)
+        if request is None:
+            return
+        (data, seconds) = request
+        cmds = ai(encoding.decode_state(data), util.Deadline(seconds))
+        channel.put_commands(seq, cmds or [])
+        seq += 1
+
+if __name__ == '__main__':
+    serve(sys.argv[2], util.load_callable(sys.argv[1]))
@@ -3,10 +3,31 @@
 # Common utility methods
 #
 
+import importlib
 import random
+import time
 
 AI_CLIENT_TIMEOUT = 300
 
+# The time by which an AI running inside the client has to return its move.
+# Such an AI cannot be killed, so it is handed one of these and is expected
+# to check it and stop by itself.
+class Deadline(object):
+    def __init__(self, seconds):
+        self.at = time.time() + seconds
+
+    def remaining(self):
+        return max(self.at - time.time(), 0)
+
+    def expired(self):
+        return time.time() >= self.at
+
+# Returns the callable named by a "module:callable" spec, such as
+# "helpers.beam_search:choose_move".
+def load_callable(spec):
+    (module, name) = spec.split(':')
+    return getattr(importlib.import_module(module), name)
+
 def generate_game_id():
     choices = 'abcdefghijklmnopqrstuvwxyz'
     choices += choices.upper()
@@ -262,7 +262,17 @@ std::vector<std::vector<move_t> > GenerateValidMoves(Board* board) {
 std::vector<move_t> FindBestMove(Board* board, const char* config) {
     ScoreVector sv;
     sv.LoadWeightsFromFile(config);
+    return FindBestMove(board, sv);
+}
 
+/*!
+ * Finds the best move with weights that are already loaded, so that a
+ * long-running AI only reads its weights file once.
+ *
+ * @param board the board to move on
+ * @param sv the weights to score boards with
+ */
+std::vector<move_t> FindBestMove(Board* board, ScoreVector& sv) {
     timeval a, b;
 
     gettimeofday(&a, 0);
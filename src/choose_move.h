@@ -74,6 +74,7 @@ class ScoreVector {
 
 std::string StringifyMove(const move_t& m);
 std::vector<move_t> FindBestMove(Board* board, const char * config);
+std::vector<move_t> FindBestMove(Board* board, ScoreVector& sv);
 std::vector<std::vector<move_t> > GenerateValidMoves(Board* board);
 
 static const double MIN_SCORE = -10e6;
@@ -245,6 +245,7 @@ Board::Board() {
 Board::Board(Object& state) {
   rows = ROWS;
   cols = COLS;
+  rows_cleared = 0;
 
   for (int i = 0; i < ROWS; i++) {
     for (int j = 0; j < COLS; j++) {
@@ -472,7 +473,59 @@ int Board::remove_rows(Bitmap* new_bitmap) {
   return rows_removed;
 }
 
+// The line the AI prints after the commands of each move in worker mode.
+static const char* DONE_MARKER = "done";
+
+// Worker mode: the client starts the AI once, as
+//
+//   dropblox_ai --worker [weights file]
+//
+// and sends it one request per move on stdin. A request is a header line
+// with the number of seconds remaining and the length in bytes of the JSON
+// game state, followed by the game state itself. The AI answers with one
+// command per line, followed by DONE_MARKER. It exits when stdin is closed.
+int RunWorker(const char* fpath) {
+  ScoreVector sv;
+  sv.LoadWeightsFromFile(fpath);
+
+  string header;
+  while (getline(cin, header)) {
+    istringstream parse(header);
+    double seconds;
+    size_t length;
+    if (!(parse >> seconds >> length)) {
+      return 1;
+    }
+    string raw(length, '\0');
+    if (length && !cin.read(&raw[0], length)) {
+      return 1;
+    }
+    istringstream raw_state(raw);
+    Object state;
+    Reader::Read(state, raw_state);
+
+    Board board(state);
+    std::vector<move_t> bestmove = FindBestMove(&board, sv);
+    for (unsigned int i = 0; i < bestmove.size(); i++) {
+      cout << StringifyMove(bestmove[i]) << "\n";
+    }
+    cout << DONE_MARKER << endl;
+
+    // Unlike a one-shot AI, a worker builds a board for every move, so the
+    // blocks it reads are freed once the move is chosen.
+    delete board.block;
+    for (unsigned int i = 0; i < board.preview.size(); i++) {
+      delete board.preview[i];
+    }
+  }
+  return 0;
+}
+
 int main(int argc, char** argv) {
+  if (argc >= 2 && strcmp(argv[1], "--worker") == 0) {
+    return RunWorker(argc >= 3 ? argv[2] : "weights.txt");
+  }
+
   // Construct a JSON Object with the given game state.
   istringstream raw_state(argv[1]);
   Object state;